@@ -46,7 +46,7 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'bangazonapi.authentication.CachedTokenAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -56,6 +56,7 @@ REST_FRAMEWORK = {
 }
 
 MIDDLEWARE = [
+    'bangazonapi.middleware.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -99,9 +100,89 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Keep each worker thread's connection, and its PRAGMAs, for this
+        # many seconds instead of reconnecting on every request
+        'CONN_MAX_AGE': 600,
     }
 }
 
+# Run on every new SQLite connection by bangazonapi.sqlite. WAL lets reads
+# proceed during writes, and writers queue for up to busy_timeout ms
+# instead of failing with "database is locked". Set to {} for SQLite's
+# defaults.
+SQLITE_PRAGMAS = {
+    'busy_timeout': 5000,
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+
+# Caches
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+# The catalog cache holds serialized product and product type responses,
+# see bangazonapi/cache.py. Swap in FileBasedCache to share it between
+# worker processes.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        'BACKEND': 'bangazonapi.cache.CountingLocMemCache',
+        'LOCATION': 'catalog',
+        'TIMEOUT': 600,
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+    # Authenticated token, user and customer per token key; the timeout
+    # bounds how stale another process's entry can be after a change
+    'auth': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'auth',
+        'TIMEOUT': 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+
+# Query instrumentation (bangazonapi.middleware). Budgets are the most
+# queries one request to an endpoint may run, counting a cold token lookup;
+# strict mode raises instead of logging, for test runs.
+SERVER_TIMING = DEBUG
+QUERY_BUDGET_STRICT = False
+QUERY_BUDGETS = {
+    'GET product-list': 6,
+    'GET product-detail': 5,
+    'GET product-newest': 4,
+    'GET product-search': 5,
+    'GET product-myproduct': 4,
+    'GET producttype-list': 3,
+    'GET producttype-detail': 4,
+    'GET producttype-products': 5,
+    'GET order-list': 7,
+    'GET order-current': 6,
+    'GET order-cart': 5,
+    'GET order-completed': 7,
+    'GET order-multipleorders': 6,
+    'GET order-carthistory': 6,
+    'POST order-bulk': 13,
+    'GET customer-list': 4,
+    'GET orderproduct-list': 3,
+    'GET paymenttype-list': 3,
+}
+
+
+# At most this many /login and /register password hashes run at once;
+# further requests get a 503 instead of waiting. Each hash holds its
+# request thread, so keep this below the server's thread count.
+PASSWORD_HASHING_WORKERS = 4
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
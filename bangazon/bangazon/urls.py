@@ -34,6 +34,9 @@ urlpatterns = [
     url(r'^', include(router.urls)),
     url(r'^register$', register_user),
     url(r'^login$', login_user),
+    url(r'^stats/cache$', cache_stats),
+    url(r'^stats/auth$', auth_stats),
+    url(r'^stats/queries$', query_stats),
     url(r'^api-token-auth/', obtain_auth_token),
     url(r'^api-auth/', include('rest_framework.urls', namespace='rest_framework')),
 ]
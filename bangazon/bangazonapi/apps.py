@@ -3,3 +3,10 @@ from django.apps import AppConfig
 
 class BangazonapiConfig(AppConfig):
     name = 'bangazonapi'
+
+    def ready(self):
+        # Connects the catalog cache and auth cache invalidation receivers,
+        # and the SQLite PRAGMAs applied to every new connection
+        from bangazonapi import cache  # pylint: disable=unused-import,import-outside-toplevel
+        from bangazonapi import authentication  # pylint: disable=unused-import,import-outside-toplevel
+        from bangazonapi import sqlite  # pylint: disable=unused-import,import-outside-toplevel
@@ -0,0 +1,79 @@
+"""Token authentication resolving token, user and customer in one cached lookup
+
+DRF's TokenAuthentication reads the token and user on every request, and
+the views then fetch the customer separately. CachedTokenAuthentication
+loads all three with one joined query and keeps the result in the `auth`
+cache from settings.CACHES, a bounded LRU whose TIMEOUT caps how long an
+entry lives. Views reach the customer as `request.user.customer` without
+another query.
+
+Entries are dropped when a token is deleted, or when a user or customer
+is saved or deleted, which covers deactivation. The local-memory cache
+lives in each process, so other processes notice within the TIMEOUT.
+"""
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from bangazonapi.models import Customer
+
+CACHE_ALIAS = 'auth'
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def _key(token_key):
+    return f"auth:token:{token_key}"
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication serving repeat clients from the auth cache"""
+
+    def authenticate_credentials(self, key):
+        cache = get_cache()
+        cached = cache.get(_key(key))
+        if cached is not None:
+            return cached
+
+        try:
+            token = Token.objects.select_related('user', 'user__customer').get(key=key)
+        except Token.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        cache.set(_key(key), (token.user, token))
+        return (token.user, token)
+
+
+def forget_user(user_id):
+    """Drop the cached authentication of every token belonging to a user"""
+    keys = Token.objects.filter(user_id=user_id).values_list('key', flat=True)
+    get_cache().delete_many([_key(key) for key in keys])
+
+
+@receiver(post_delete, sender=Token)
+def forget_token(sender, instance, **kwargs):
+    """A deleted token stops authenticating at once"""
+    get_cache().delete(_key(instance.key))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_changed_user(sender, instance, **kwargs):
+    """A saved user may be deactivated; either way the cached copy is stale"""
+    forget_user(instance.pk)
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+def forget_changed_customer(sender, instance, **kwargs):
+    """Cached users carry their customer, so a customer change drops them too"""
+    forget_user(instance.user_id)
@@ -0,0 +1,94 @@
+"""Bulk row inserts that skip model instances
+
+bulk_create builds a model instance per row and compiles a multi-row
+INSERT for every few hundred of them, which dominates the time of loads
+in the millions of rows. insert_rows takes plain tuples, prepares only
+the columns whose Python values differ from what the database stores,
+and sends them through one executemany per batch.
+
+No model save() runs and no signal is sent, so callers finish with
+rebuild_derived() to bring back what those would have kept up to date.
+"""
+from io import StringIO
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connections
+from bangazonapi.cache import invalidate
+from bangazonapi.models import TableVersion
+from bangazonapi.models.productsearch import rebuild_search_index
+
+# Field types whose values have to go through get_db_prep_save;
+# everything else is stored as the Python value is
+PREPARED_TYPES = {'DateField', 'DateTimeField', 'TimeField', 'DecimalField', 'DurationField',
+                  'UUIDField', 'BinaryField'}
+
+
+def next_id(model, using=DEFAULT_DB_ALIAS):
+    """The id after the largest one in a model's table, for assigning ids up front"""
+    last = model._default_manager.using(using).order_by('-pk').values_list('pk', flat=True).first()
+    return (last or 0) + 1
+
+
+def _default(field, connection):
+    if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+        value = field.pre_save(field.model(), add=True)
+    else:
+        value = field.get_default()
+    return field.get_db_prep_save(value, connection)
+
+
+def insert_rows(model, columns, rows, using=DEFAULT_DB_ALIAS, raw=False):
+    """INSERT rows into a model's table with executemany
+
+    Arguments:
+        model -- model whose table receives the rows
+        columns -- field names or attnames the tuples hold, in order;
+            concrete fields left out get their default, or now() for
+            auto_now fields, prepared once
+        rows -- iterable of tuples of Python values
+        using -- database alias
+        raw -- the rows already hold database values, as read back by a
+            cursor, and are inserted without preparing them
+    Returns:
+        int -- rows inserted
+    """
+    connection = connections[using]
+    fields = [model._meta.get_field(column) for column in columns]
+    named = {field.name for field in fields}
+    missing = [field for field in model._meta.concrete_fields
+               if field.name not in named and not field.primary_key]
+    defaults = tuple(_default(field, connection) for field in missing)
+
+    prepared = [position for position, field in enumerate(fields)
+                if not raw and field.get_internal_type() in PREPARED_TYPES]
+
+    def values(row):
+        if prepared:
+            row = list(row)
+            for position in prepared:
+                row[position] = fields[position].get_db_prep_save(row[position], connection)
+            row = tuple(row)
+        return row + defaults
+
+    quote = connection.ops.quote_name
+    names = ", ".join(quote(field.column) for field in fields + missing)
+    placeholders = ", ".join(["%s"] * (len(fields) + len(missing)))
+    sql = f"INSERT INTO {quote(model._meta.db_table)} ({names}) VALUES ({placeholders})"
+
+    batch = [values(row) for row in rows]
+    if batch:
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, batch)
+    return len(batch)
+
+
+def rebuild_derived():
+    """Recompute what saves and signals keep current, after rows were inserted raw
+
+    Rebuilds Product.total_sold and the product search index, bumps the
+    table versions behind conditional GETs, and moves the catalog cache
+    to new versions.
+    """
+    call_command('rebuildsalescounters', stdout=StringIO())
+    rebuild_search_index()
+    TableVersion.bump('product', 'producttype', 'order', 'paymenttype', 'customer')
+    invalidate('products', 'types', 'customers')
@@ -0,0 +1,167 @@
+"""Response cache for the read-heavy catalog endpoints
+
+GET /products, /products/{id}, /products/newest, /producttypes and
+/producttypes/{id} store their serialized data in the `catalog` cache
+from settings.CACHES. Every
+entry is keyed by the full URL (path, query params and paging) plus the
+current version of each namespace it depends on:
+
+    products         -- any product changed; product type pages embed
+                        their products, so they depend on it too
+    product:<id>     -- that product changed
+    types            -- any product type changed; product pages embed
+                        their type, so they depend on it too
+    producttype:<id> -- that product type changed
+    customers        -- any customer or user changed; product pages and
+                        product type pages embed the seller's customer
+
+Product, ProductType, Customer and User signals bump only the namespaces
+a change can affect, so every other entry stays warm. Entries left behind by a bump are
+never read again and age out through the cache timeout.
+"""
+import functools
+import hashlib
+import time
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from rest_framework import status
+from rest_framework.response import Response
+from bangazonapi.models import Customer, Product, ProductType
+from bangazonapi.models.product import products_updated
+
+CACHE_ALIAS = 'catalog'
+STAT_KEYS = ('hits', 'misses', 'invalidations')
+
+
+class CountingLocMemCache(LocMemCache):
+    """Local-memory cache that counts entries culled to stay under MAX_ENTRIES"""
+
+    def __init__(self, name, params):
+        super().__init__(name, params)
+        self.evictions = 0
+
+    def _cull(self):
+        entries = len(self._cache)
+        super()._cull()
+        self.evictions += entries - len(self._cache)
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def _count(stat):
+    cache = get_cache()
+    key = f"catalog:stats:{stat}"
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def _versions(namespaces):
+    cache = get_cache()
+    keys = [f"catalog:version:{namespace}" for namespace in namespaces]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # A lost version restarts from the clock, never from a value
+            # that entries still in the cache were stored under
+            versions[key] = int(time.time() * 1000)
+            cache.add(key, versions[key], None)
+    return [str(versions[key]) for key in keys]
+
+
+def invalidate(*namespaces):
+    """Move each namespace to a new version, orphaning its cached entries"""
+    cache = get_cache()
+    for namespace in namespaces:
+        key = f"catalog:version:{namespace}"
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, int(time.time() * 1000), None)
+        _count('invalidations')
+
+
+def cached_response(*namespaces):
+    """Decorator caching the data of a ViewSet method's 200 responses
+
+    Arguments:
+        namespaces -- namespaces the response depends on; `{pk}` is filled
+            in from the URL, as in `product:{pk}`
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            resolved = [namespace.format(**kwargs) for namespace in namespaces]
+            fingerprint = "|".join([request.build_absolute_uri()] + _versions(resolved))
+            key = "catalog:response:" + hashlib.md5(fingerprint.encode('utf-8')).hexdigest()
+
+            cache = get_cache()
+            data = cache.get(key)
+            if data is not None:
+                _count('hits')
+                return Response(data)
+
+            _count('misses')
+            response = method(self, request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                cache.set(key, response.data)
+            return response
+        return wrapper
+    return decorator
+
+
+def stats():
+    """Hit rate and eviction counters of the catalog cache
+
+    Returns:
+        dict -- hits, misses, hit_rate, invalidations, and for the local
+            memory backend the current entries and capacity evictions
+    """
+    cache = get_cache()
+    counters = cache.get_many([f"catalog:stats:{stat}" for stat in STAT_KEYS])
+    result = {stat: counters.get(f"catalog:stats:{stat}", 0) for stat in STAT_KEYS}
+    lookups = result['hits'] + result['misses']
+    result['hit_rate'] = result['hits'] / lookups if lookups else 0.0
+    if isinstance(cache, CountingLocMemCache):
+        result['entries'] = len(cache._cache)
+        result['evictions'] = cache.evictions
+    return result
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product(sender, instance, **kwargs):
+    """A product change reaches its own page, the product lists and the type pages"""
+    invalidate(f"product:{instance.pk}", "products")
+
+
+@receiver(products_updated)
+def invalidate_updated_products(sender, product_ids, **kwargs):
+    """Same as invalidate_product for products changed with queryset.update()"""
+    invalidate(*[f"product:{product_id}" for product_id in product_ids], "products")
+
+
+@receiver(post_save, sender=ProductType)
+@receiver(post_delete, sender=ProductType)
+def invalidate_product_type(sender, instance, **kwargs):
+    """A product type change reaches its own page and every page embedding types"""
+    invalidate(f"producttype:{instance.pk}", "types")
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def invalidate_customer(sender, **kwargs):
+    """A customer or user change reaches every page embedding a seller"""
+    if kwargs.get('action', 'post_').startswith('post_'):
+        invalidate("customers")
@@ -0,0 +1,97 @@
+"""Bounded admission for password hashing
+
+PBKDF2 is deliberately slow, and login_user and register_user used to
+hash with no limit, so a burst of logins could hold every request worker
+and stall catalog reads. At most PASSWORD_HASHING_WORKERS hashes now run
+at once, each on its own request thread; hashlib releases the GIL, so
+they still run in parallel. A call beyond that is refused at once with
+HashingBusy so the view can answer 503, rather than holding its thread
+while it waits. Keep the limit well below the server's request thread
+count.
+
+Database work is unaffected; only the hash is admitted.
+"""
+import threading
+import time
+from django.conf import settings
+
+_lock = threading.Lock()
+_slots = None
+_stats = {}
+
+
+class HashingBusy(Exception):
+    """Raised when PASSWORD_HASHING_WORKERS hashes are already running"""
+
+
+def _admission():
+    global _slots
+    with _lock:
+        if _slots is None:
+            _slots = threading.BoundedSemaphore(settings.PASSWORD_HASHING_WORKERS)
+        return _slots
+
+
+def _record(endpoint, outcome, seconds=0.0):
+    with _lock:
+        counters = _stats.setdefault(endpoint, {
+            'completed': 0, 'rejected': 0, 'failed': 0, 'in_flight': 0,
+            'hash_seconds': 0.0, 'max_hash_seconds': 0.0})
+        if outcome == 'started':
+            counters['in_flight'] += 1
+            return
+        if outcome == 'rejected':
+            counters['rejected'] += 1
+            return
+        counters['in_flight'] -= 1
+        counters[outcome] += 1
+        counters['hash_seconds'] += seconds
+        counters['max_hash_seconds'] = max(counters['max_hash_seconds'], seconds)
+
+
+def run(endpoint, function, *args):
+    """Run a hashing function on the calling thread if a slot is free
+
+    Arguments:
+        endpoint -- name the call is counted under in stats(), such as 'login'
+        function -- hashing function, such as check_password or make_password
+        args -- arguments for the function
+    Returns:
+        the function's return value
+    Raises:
+        HashingBusy -- when every slot is taken
+    """
+    slots = _admission()
+    if not slots.acquire(blocking=False):
+        _record(endpoint, 'rejected')
+        raise HashingBusy(f"Password hashing is saturated, retry {endpoint} shortly")
+
+    _record(endpoint, 'started')
+    started = time.perf_counter()
+    try:
+        result = function(*args)
+    except Exception:
+        _record(endpoint, 'failed', time.perf_counter() - started)
+        raise
+    finally:
+        slots.release()
+    _record(endpoint, 'completed', time.perf_counter() - started)
+    return result
+
+
+def stats():
+    """Hashing counters per endpoint, kept apart from the rest of the API
+
+    Returns:
+        dict -- for each endpoint: completed, rejected, failed and in-flight
+            counts, mean and max seconds per hash, and the configured
+            number of concurrent hashes
+    """
+    with _lock:
+        result = {'workers': settings.PASSWORD_HASHING_WORKERS}
+        for endpoint, counters in _stats.items():
+            finished = counters['completed'] + counters['failed']
+            result[endpoint] = dict(
+                counters,
+                mean_hash_seconds=counters['hash_seconds'] / finished if finished else 0.0)
+        return result
@@ -0,0 +1,39 @@
+"""Management command for freezing prices and totals on older completed orders"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, FloatField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from bangazonapi.models import Order, OrderProduct, Product
+
+
+class Command(BaseCommand):
+    """Store unit_price, total and item_count on completed orders missing them
+
+    Orders checked out before totals were stored have no price at
+    purchase, so their lines are frozen at the current product prices.
+    Orders that already have a total are left alone.
+
+    Example:
+        python manage.py backfillordertotals
+    """
+
+    help = "Freeze line prices and order totals on completed orders that lack them."
+
+    def handle(self, *args, **options):
+        price = Product.objects.filter(pk=OuterRef('product_id')).values('price')
+        lines = OrderProduct.objects.filter(order=OuterRef('pk')).values('order')
+        total = lines.annotate(
+            total=Sum(F('quantity') * F('unit_price'), output_field=FloatField())).values('total')
+        item_count = lines.annotate(item_count=Sum('quantity')).values('item_count')
+
+        with transaction.atomic():
+            priced = OrderProduct.objects.filter(
+                order__payment_type__isnull=False, order__total__isnull=True,
+                unit_price__isnull=True).update(unit_price=Subquery(price))
+            orders = Order.objects.filter(
+                payment_type__isnull=False, total__isnull=True).update(
+                    total=Coalesce(Subquery(total), 0.0),
+                    item_count=Coalesce(Subquery(item_count), 0))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Priced {priced} order line(s) and stored totals on {orders} order(s)"))
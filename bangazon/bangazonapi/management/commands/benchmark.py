@@ -0,0 +1,222 @@
+"""Management command benchmarking the API routes against a seeded database"""
+import json
+import platform
+import statistics
+import sys
+import time
+import django
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from bangazonapi.models import Order, Product, ProductType
+from bangazonapi.percentiles import percentile
+from bangazonapi.seed import seed_database
+
+
+def endpoints(context):
+    """(name, method, path, body) for every benchmarked request
+
+    Arguments:
+        context -- ids picked from the seeded data
+    """
+    product_ids = context['product_ids']
+    return [
+        ('products', 'get', '/products', None),
+        ('products by category', 'get', f"/products?category={context['product_type_id']}", None),
+        ('products cursor page', 'get', '/products?cursor=&limit=20', None),
+        ('product detail', 'get', f"/products/{product_ids[0]}", None),
+        ('newest products', 'get', '/products/newest?limit=20', None),
+        ('product search', 'get', '/products/search?q=lamp', None),
+        ('product types', 'get', '/producttypes', None),
+        ('product type products', 'get', f"/producttypes/{context['product_type_id']}/products", None),
+        ('orders', 'get', '/orders?limit=20', None),
+        ('completed orders', 'get', '/orders/completed', None),
+        ('cart', 'get', '/orders/cart', None),
+        ('cart history', 'get', f"/orders/carthistory?order={context['order_id']}", None),
+        ('customers', 'get', '/customers?limit=20', None),
+        ('order products', 'get', '/orderproducts?limit=20', None),
+        ('payment types', 'get', '/paymenttypes', None),
+        ('add to cart', 'post', '/orders', {'product_id': product_ids[1]}),
+        ('bulk add to cart', 'post', '/orders/bulk',
+         {'add': [{'product_id': product_id} for product_id in product_ids[2:12]]}),
+    ]
+
+
+class Command(BaseCommand):
+    """Seed a throwaway test database, time every route, report a JSON baseline
+
+    The database is created like a test run's, seeded deterministically
+    with bangazonapi.seed, and destroyed afterwards; the configured
+    database is never touched. Each endpoint is requested --warmup times,
+    then timed over --requests sequential requests through the Django test
+    client, so the numbers include middleware, authentication, caching and
+    rendering but no network.
+
+    Example:
+        python manage.py benchmark --products 20000 --output baseline.json
+        python manage.py benchmark --products 20000 --baseline baseline.json --max-regression 1.25
+    """
+
+    help = "Benchmark the API routes on seeded data and report latency, throughput and queries as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=500)
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--orders', type=int, default=5000)
+        parser.add_argument('--lines', type=int, default=3, help="Average lines per order.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed for the data.")
+        parser.add_argument('--requests', type=int, default=200, help="Timed requests per endpoint.")
+        parser.add_argument('--warmup', type=int, default=10, help="Untimed requests per endpoint.")
+        parser.add_argument('--cold', action='store_true',
+                            help="Clear the catalog cache before every request.")
+        parser.add_argument('--only', help="Comma separated endpoint names to run.")
+        parser.add_argument('--output', help="Write the JSON report here instead of stdout.")
+        parser.add_argument('--baseline', help="Earlier JSON report to compare against.")
+        parser.add_argument('--max-regression', type=float, default=None,
+                            help="Fail when an endpoint's p95 exceeds the baseline's by this factor.")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            report = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        regressions = []
+        if options['baseline']:
+            regressions = self.compare(report, options['baseline'], options['max_regression'])
+
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(text + '\n')
+            self.stderr.write(f"Wrote {options['output']}")
+        else:
+            self.stdout.write(text)
+
+        if regressions and options['max_regression'] is not None:
+            for regression in regressions:
+                self.stderr.write(regression)
+            raise CommandError(f"{len(regressions)} endpoint(s) regressed against {options['baseline']}")
+
+    def run(self, options):
+        started = time.perf_counter()
+        seeded = seed_database(
+            customers=options['customers'], products=options['products'],
+            orders=options['orders'], lines_per_order=options['lines'],
+            random_seed=options['seed'], log=lambda message: self.stderr.write(message))
+        seed_seconds = time.perf_counter() - started
+
+        context = {
+            'product_ids': list(Product.objects.order_by('id').values_list('id', flat=True)[:12]),
+            'product_type_id': ProductType.objects.order_by('id').values_list('id', flat=True)[0],
+            'order_id': Order.objects.filter(
+                customer__user_id=seeded['user_id']).order_by('id').values_list('id', flat=True)[0],
+        }
+        selected = endpoints(context)
+        if options['only']:
+            names = {name.strip() for name in options['only'].split(',')}
+            selected = [endpoint for endpoint in selected if endpoint[0] in names]
+            if not selected:
+                raise CommandError(f"No endpoint matches --only {options['only']}")
+
+        client = Client(HTTP_AUTHORIZATION=f"Token {seeded['token']}")
+        results = {}
+        for name, method, path, body in selected:
+            self.stderr.write(f"{name}: {method.upper()} {path}")
+            results[name] = self.measure(client, method, path, body, options)
+
+        return {
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'platform': sys.platform,
+            },
+            'parameters': {key: options[key] for key in
+                           ('customers', 'products', 'orders', 'lines', 'seed',
+                            'requests', 'warmup', 'cold')},
+            'seed_seconds': round(seed_seconds, 3),
+            'rows': {key: seeded[key] for key in ('customers', 'products', 'orders', 'order_lines')},
+            'endpoints': results,
+        }
+
+    @staticmethod
+    def measure(client, method, path, body, options):
+        """Time one endpoint
+
+        Returns:
+            dict -- latency percentiles in ms, requests per second, query
+                counts and response sizes
+        """
+        catalog = caches['catalog']
+
+        def send():
+            if options['cold']:
+                catalog.clear()
+            if method == 'get':
+                response = client.get(path)
+            else:
+                response = client.generic(method.upper(), path, json.dumps(body),
+                                          content_type='application/json')
+            if response.streaming:
+                return response, sum(len(chunk) for chunk in response.streaming_content)
+            return response, len(response.content)
+
+        for _ in range(options['warmup']):
+            send()
+
+        latencies, queries, sizes, statuses = [], [], [], set()
+        for _ in range(options['requests']):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response, size = send()
+                latencies.append((time.perf_counter() - started) * 1000)
+            queries.append(len(captured))
+            sizes.append(size)
+            statuses.add(response.status_code)
+
+        return {
+            'status': sorted(statuses),
+            'p50_ms': round(percentile(latencies, 0.50), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+            'mean_ms': round(statistics.mean(latencies), 3),
+            'requests_per_second': round(1000 * len(latencies) / sum(latencies), 1),
+            'queries_median': statistics.median(queries),
+            'queries_max': max(queries),
+            'bytes_median': statistics.median(sizes),
+        }
+
+    @staticmethod
+    def compare(report, path, max_regression):
+        """Add each endpoint's change against a baseline report to the report
+
+        Returns:
+            list -- endpoints whose p95 grew past max_regression times the
+                baseline's, or that ran more queries
+        """
+        with open(path) as baseline_file:
+            baseline = json.load(baseline_file)['endpoints']
+
+        regressions = []
+        for name, result in report['endpoints'].items():
+            before = baseline.get(name)
+            if before is None:
+                continue
+            ratio = result['p95_ms'] / before['p95_ms'] if before['p95_ms'] else None
+            result['baseline'] = {
+                'p95_ratio': round(ratio, 3) if ratio is not None else None,
+                'queries_delta': result['queries_max'] - before['queries_max'],
+            }
+            if max_regression is not None and ratio is not None and ratio > max_regression:
+                regressions.append(f"{name}: p95 {before['p95_ms']}ms -> {result['p95_ms']}ms")
+            if result['queries_max'] > before['queries_max']:
+                regressions.append(f"{name}: queries {before['queries_max']} -> {result['queries_max']}")
+
+        report['regressions'] = regressions
+        return regressions
@@ -0,0 +1,217 @@
+"""Management command benchmarking reads against concurrent cart writes"""
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.test.utils import override_settings
+from bangazonapi.models import Customer, Order, OrderProduct, PaymentType, Product
+from bangazonapi.models.order import OrderCompleted
+from bangazonapi.models.product import OutOfStock
+from bangazonapi.percentiles import percentile
+from bangazonapi.seed import seed_database
+from bangazonapi.sqlite import pragma_values
+
+# Cart additions per checkout in the write workload
+ADDS_PER_CHECKOUT = 3
+
+
+def _summary(latencies, seconds):
+    if not latencies:
+        return {'count': 0, 'per_second': 0.0}
+    return {
+        'count': len(latencies),
+        'per_second': round(len(latencies) / seconds, 1),
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'max_ms': round(max(latencies), 3),
+    }
+
+
+class Workload:
+    """Reader and writer threads sharing one stop flag and result lists"""
+
+    def __init__(self, customers, product_ids, type_ids, random_seed):
+        self.customers = customers
+        self.product_ids = product_ids
+        self.type_ids = type_ids
+        self.random_seed = random_seed
+        self.stop = threading.Event()
+        self.lock = threading.Lock()
+        self.reads, self.writes = [], []
+        self.errors = {'locked': 0, 'out_of_stock': 0, 'completed': 0}
+
+    def _error(self, kind):
+        with self.lock:
+            self.errors[kind] += 1
+
+    def read(self, number):
+        """Product listings and order history, the reads a browsing customer makes"""
+        generator = random.Random(f"{self.random_seed}:read:{number}")
+        latencies = []
+        try:
+            while not self.stop.is_set():
+                started = time.perf_counter()
+                try:
+                    list(Product.objects.filter(product_type_id=generator.choice(self.type_ids))
+                         .order_by('-id')[:20])
+                    user_id = generator.choice(self.customers)[0]
+                    list(OrderProduct.objects.filter(order__customer__user_id=user_id)
+                         .select_related('product').order_by('-id')[:20])
+                except OperationalError:
+                    self._error('locked')
+                    continue
+                latencies.append((time.perf_counter() - started) * 1000)
+        finally:
+            connection.close()
+        with self.lock:
+            self.reads.extend(latencies)
+
+    def write(self, number):
+        """Add to cart and check out, as the API does, for one customer"""
+        generator = random.Random(f"{self.random_seed}:write:{number}")
+        user_id, payment_type_id = self.customers[number % len(self.customers)]
+        latencies = []
+        adds = 0
+        try:
+            while not self.stop.is_set():
+                started = time.perf_counter()
+                try:
+                    cart = Order.open_cart(user_id, create=True)
+                    OrderProduct.add(cart.pk, generator.choice(self.product_ids))
+                    adds += 1
+                    if adds % ADDS_PER_CHECKOUT == 0:
+                        cart.checkout(payment_type_id)
+                except OperationalError:
+                    self._error('locked')
+                    continue
+                except OutOfStock:
+                    self._error('out_of_stock')
+                except OrderCompleted:
+                    self._error('completed')
+                latencies.append((time.perf_counter() - started) * 1000)
+        finally:
+            connection.close()
+        with self.lock:
+            self.writes.extend(latencies)
+
+
+class Command(BaseCommand):
+    """Measure read throughput and latency while writers add to carts and check out
+
+    Each profile gets its own file-backed test database in a temporary
+    directory, since an in-memory database has no journal to compare. It
+    is seeded with bangazonapi.seed. Then --readers threads list products
+    and order history while --writers threads add to carts and check out
+    through Order and OrderProduct, for --seconds. The `default` profile
+    runs with SQLite's own settings, rollback journal and all, and
+    `configured` runs with settings.SQLITE_PRAGMAS. "database is locked"
+    failures are counted rather than raised.
+
+    Example:
+        python manage.py benchmarkcontention
+        python manage.py benchmarkcontention --readers 8 --writers 4 --seconds 20 --output contention.json
+    """
+
+    help = "Benchmark SQLite reads during cart and checkout write bursts, default vs configured PRAGMAs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=10.0, help="Run time per profile.")
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--customers', type=int, default=200)
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--orders', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0, help="Random seed for data and workload.")
+        parser.add_argument('--profile', choices=('both', 'default', 'configured'), default='both')
+        parser.add_argument('--output', help="Write the JSON report here instead of stdout.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("benchmarkcontention compares SQLite settings; the database is "
+                               f"{connection.vendor}")
+        if options['readers'] < 1 or options['writers'] < 1:
+            raise CommandError("--readers and --writers must be at least 1")
+
+        profiles = {'default': {}, 'configured': getattr(settings, 'SQLITE_PRAGMAS', {})}
+        if options['profile'] != 'both':
+            profiles = {options['profile']: profiles[options['profile']]}
+
+        report = {'parameters': {key: options[key] for key in
+                                 ('seconds', 'readers', 'writers', 'customers', 'products',
+                                  'orders', 'seed')},
+                  'profiles': {}}
+        for name, pragmas in profiles.items():
+            self.stderr.write(f"{name}: {pragmas or 'SQLite defaults'}")
+            with override_settings(SQLITE_PRAGMAS=pragmas):
+                report['profiles'][name] = self.run_profile(options)
+
+        if len(report['profiles']) == 2:
+            before, after = report['profiles']['default'], report['profiles']['configured']
+            report['configured_vs_default'] = {
+                measure: round(after[measure]['per_second'] / before[measure]['per_second'], 2)
+                if before[measure]['per_second'] else None
+                for measure in ('reads', 'writes')
+            }
+
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(text + '\n')
+            self.stderr.write(f"Wrote {options['output']}")
+        else:
+            self.stdout.write(text)
+
+    def run_profile(self, options):
+        test_settings = connection.settings_dict.setdefault('TEST', {})
+        old_test_name = test_settings.get('NAME')
+        with tempfile.TemporaryDirectory() as directory:
+            test_settings['NAME'] = os.path.join(directory, 'contention.sqlite3')
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                return self.measure(options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                test_settings['NAME'] = old_test_name
+
+    def measure(self, options):
+        seed_database(customers=options['customers'], products=options['products'],
+                      orders=options['orders'], open_carts=0, random_seed=options['seed'])
+        pragmas = pragma_values(connection, ('journal_mode', 'synchronous', 'busy_timeout',
+                                             'mmap_size', 'cache_size'))
+        payment_types = dict(PaymentType.objects.values_list('customer_id', 'id'))
+        customers = [(user_id, payment_types[customer_id]) for customer_id, user_id in
+                     Customer.objects.order_by('id').values_list('id', 'user_id')]
+        # Plenty of stock, so checkouts measure writing rather than failing
+        Product.objects.update(quantity=1000000)
+        workload = Workload(
+            customers, list(Product.objects.values_list('id', flat=True)),
+            list(Product.objects.values_list('product_type_id', flat=True).distinct()),
+            options['seed'])
+        # Each thread opens its own connection, so the seeding one is let go
+        connection.close()
+
+        threads = ([threading.Thread(target=workload.read, args=(number,))
+                    for number in range(options['readers'])] +
+                   [threading.Thread(target=workload.write, args=(number,))
+                    for number in range(options['writers'])])
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(options['seconds'])
+        workload.stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        return {
+            'pragmas': pragmas,
+            'reads': _summary(workload.reads, elapsed),
+            'writes': _summary(workload.writes, elapsed),
+            'errors': workload.errors,
+        }
@@ -0,0 +1,21 @@
+"""Management command for merging per-unit cart rows into quantity lines"""
+from django.core.management.base import BaseCommand
+from bangazonapi.models import OrderProduct
+
+
+class Command(BaseCommand):
+    """Collapse repeated (order, product) OrderProduct rows into one line each
+
+    Carts used to store one row per unit. Run it once the quantity column
+    exists and before the unique (order, product) constraint is applied;
+    running it again is a no-op.
+
+    Example:
+        python manage.py collapsecartlines
+    """
+
+    help = "Merge duplicate order lines into a single line with a summed quantity."
+
+    def handle(self, *args, **options):
+        deleted = OrderProduct.collapse_duplicates()
+        self.stdout.write(self.style.SUCCESS(f"Removed {deleted} duplicate order line(s)"))
@@ -0,0 +1,66 @@
+"""Management command generating a large synthetic dataset"""
+import time
+from django.core.management.base import BaseCommand, CommandError
+from bangazonapi.seed import DEFAULT_BATCH_SIZE, DEFAULT_SKEW, PASSWORD, seed_database
+
+
+class Command(BaseCommand):
+    """Fill the configured database with realistic users, products and orders
+
+    Every customer gets a user, a token and a payment type. Products are
+    spread over the product types, and orders buy products and come from
+    customers with skewed popularity, a few of them accounting for most
+    sales. Some customers are left with an open cart. Rows are written in
+    batches with executemany, parents before children, in one transaction;
+    sales counters, the search index and the cached catalog are rebuilt
+    at the end.
+
+    The same options and --seed give the same data; on an empty database
+    the ids match as well. Usernames continue after the existing users, so
+    the command can add to a database that already has data.
+
+    Example:
+        python manage.py generatedata
+        python manage.py generatedata --customers 1000000 --products 500000 --orders 3000000 --seed 7
+    """
+
+    help = "Generate deterministic synthetic customers, products and orders in bulk."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=10000)
+        parser.add_argument('--products', type=int, default=50000)
+        parser.add_argument('--orders', type=int, default=100000)
+        parser.add_argument('--lines', type=int, default=3, help="Average lines per order.")
+        parser.add_argument(
+            '--open-carts', type=int, default=None,
+            help="Orders left as open carts, one per customer (default: a tenth of the customers).")
+        parser.add_argument(
+            '--skew', type=float, default=DEFAULT_SKEW,
+            help=f"Zipf exponent of product and customer popularity, 0 for uniform (default {DEFAULT_SKEW}).")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed for the data.")
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help=f"Rows generated and written per step (default {DEFAULT_BATCH_SIZE}).")
+
+    def handle(self, *args, **options):
+        if options['customers'] < 1 or options['products'] < 1:
+            raise CommandError("--customers and --products must be at least 1")
+        if options['lines'] < 1 or options['batch_size'] < 1:
+            raise CommandError("--lines and --batch-size must be at least 1")
+
+        started = time.perf_counter()
+        seeded = seed_database(
+            customers=options['customers'], products=options['products'],
+            orders=options['orders'], lines_per_order=options['lines'],
+            open_carts=options['open_carts'], random_seed=options['seed'],
+            skew=options['skew'], batch_size=options['batch_size'],
+            log=self.stdout.write)
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {seeded['customers']} customer(s), {seeded['products']} product(s), "
+            f"{seeded['orders']} order(s) and {seeded['order_lines']} order line(s) "
+            f"in {elapsed:.1f}s"))
+        self.stdout.write(
+            f"Every generated user's password is {PASSWORD!r}; "
+            f"user {seeded['user_id']} has token {seeded['token']}")
@@ -0,0 +1,168 @@
+"""Management command for importing customer accounts in bulk"""
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.authtoken.models import Token
+from bangazonapi.models import Customer
+
+FIELDS = ('username', 'email', 'password', 'first_name', 'last_name', 'phone_number', 'address')
+
+# Keeps each username__in lookup under SQLite's bound parameter limit
+DEFAULT_BATCH_SIZE = 500
+
+
+def _init_worker():
+    # Spawned workers start without Django; forked ones already have it
+    django.setup()
+
+
+def read_rows(path, file_format):
+    """Yield (line number, row dict) from a CSV file with a header or a JSONL file
+
+    Lines that are not valid JSON yield None instead of a dict.
+    """
+    with open(path, newline='', encoding='utf-8') as source:
+        if file_format == 'csv':
+            for line, row in enumerate(csv.DictReader(source), start=2):
+                yield line, row
+        else:
+            for line, text in enumerate(source, start=1):
+                if not text.strip():
+                    continue
+                try:
+                    yield line, json.loads(text)
+                except ValueError:
+                    yield line, None
+
+
+def new_token(user_id):
+    """Unsaved Token with its key filled in, since bulk_create skips Token.save"""
+    token = Token(user_id=user_id)
+    token.key = token.generate_key()
+    return token
+
+
+class Command(BaseCommand):
+    """Create User, Customer and Token rows for every account in a file
+
+    Rows are read as a stream and handled in batches. Each batch's
+    passwords are hashed across a process pool, then its users, customers
+    and tokens are written with bulk_create in one transaction. Usernames
+    that already exist are skipped, so an interrupted import resumes by
+    running the same command again.
+
+    Each row needs the register fields: username, email, password,
+    first_name, last_name, phone_number and address.
+
+    Example:
+        python manage.py importusers partner_users.csv
+        python manage.py importusers partner_users.jsonl --batch-size 1000 --workers 8
+    """
+
+    help = "Import customer accounts from a CSV or JSONL file in bulk."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV file with a header row, or JSONL file.")
+        parser.add_argument(
+            '--format', dest='file_format', choices=('csv', 'jsonl'),
+            help="File format; taken from the file extension when omitted.")
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help=f"Accounts hashed and written per transaction (default {DEFAULT_BATCH_SIZE}).")
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help="Processes hashing passwords (default: one per CPU).")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['file_format']
+        if file_format is None:
+            file_format = 'jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv'
+        if not os.path.exists(path):
+            raise CommandError(f"No such file: {path}")
+
+        totals = {'created': 0, 'skipped': 0, 'invalid': 0}
+        rows = read_rows(path, file_format)
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker) as pool:
+            while True:
+                batch = list(islice(rows, options['batch_size']))
+                if not batch:
+                    break
+                created, skipped, invalid = self.import_batch(batch, pool, options['workers'])
+                totals['created'] += created
+                totals['skipped'] += skipped
+                totals['invalid'] += len(invalid)
+                for line, reason in invalid:
+                    self.stderr.write(f"Line {line}: {reason}")
+                self.stdout.write(
+                    f"Created {totals['created']}, skipped {totals['skipped']} existing, "
+                    f"{totals['invalid']} invalid")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {totals['created']} account(s); {totals['skipped']} already existed, "
+            f"{totals['invalid']} invalid row(s) left out"))
+
+    def import_batch(self, batch, pool, workers):
+        """Hash and write one batch of rows
+
+        Returns:
+            tuple -- accounts created, accounts skipped as existing, and a
+                list of (line, reason) for invalid rows
+        """
+        accounts = {}
+        invalid = []
+        for line, row in batch:
+            if not isinstance(row, dict):
+                invalid.append((line, "not a JSON object"))
+                continue
+            missing = [field for field in FIELDS if not row.get(field)]
+            if missing:
+                invalid.append((line, f"missing {', '.join(missing)}"))
+                continue
+            username = User.normalize_username(row['username'])
+            if username in accounts:
+                invalid.append((line, f"duplicate username {username}"))
+                continue
+            accounts[username] = row
+
+        existing = set(User.objects.filter(username__in=list(accounts))
+                       .values_list('username', flat=True))
+        for username in existing:
+            del accounts[username]
+        if not accounts:
+            return 0, len(existing), invalid
+
+        passwords = [row['password'] for row in accounts.values()]
+        chunksize = max(1, len(passwords) // (workers * 4))
+        hashes = pool.map(make_password, passwords, chunksize=chunksize)
+
+        users = [
+            User(username=username,
+                 email=User.objects.normalize_email(row['email']),
+                 password=password,
+                 first_name=row['first_name'],
+                 last_name=row['last_name'])
+            for (username, row), password in zip(accounts.items(), hashes)
+        ]
+
+        with transaction.atomic():
+            User.objects.bulk_create(users)
+            # bulk_create does not return primary keys on every backend
+            user_ids = dict(User.objects.filter(username__in=list(accounts))
+                            .values_list('username', 'id'))
+            Customer.objects.bulk_create([
+                Customer(user_id=user_ids[username],
+                         phone_number=row['phone_number'],
+                         address=row['address'])
+                for username, row in accounts.items()
+            ])
+            Token.objects.bulk_create([new_token(user_ids[username]) for username in accounts])
+
+        return len(accounts), len(existing), invalid
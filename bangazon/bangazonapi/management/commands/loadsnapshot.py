@@ -0,0 +1,93 @@
+"""Management command for loading a snapshot written by dumpsnapshot"""
+import os
+import time
+from itertools import islice
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connections, transaction
+from bangazonapi.bulk import insert_rows, rebuild_derived
+from bangazonapi.snapshot import SnapshotError, open_snapshot, read_snapshot, snapshot_models
+
+DEFAULT_BATCH_SIZE = 10000
+
+
+class Command(BaseCommand):
+    """Bulk load a snapshot in place of loaddata
+
+    Tables are filled in foreign key order with executemany batches of
+    the stored values; no model instance is built and no save() or signal
+    runs. Foreign key checks are switched off while loading, like
+    loaddata does, and every loaded table is checked once at the end
+    before the transaction commits. Sales counters, the search index,
+    table versions and the catalog caches are then rebuilt.
+
+    The snapshot tables must be empty unless --replace is given, which
+    deletes their rows first.
+
+    Example:
+        python manage.py loadsnapshot production.snapshot.gz
+        python manage.py loadsnapshot production.snapshot.gz --replace
+    """
+
+    help = "Load a snapshot written by dumpsnapshot with bulk inserts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Snapshot file to load.")
+        parser.add_argument(
+            '--replace', action='store_true',
+            help="Delete the rows already in the snapshot tables before loading.")
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help=f"Rows inserted per executemany (default {DEFAULT_BATCH_SIZE}).")
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options['path']):
+            raise CommandError(f"No such file: {options['path']}")
+        using = options['database']
+        connection = connections[using]
+        models = snapshot_models()
+
+        started = time.perf_counter()
+        loaded = {}
+        try:
+            with connection.constraint_checks_disabled(), transaction.atomic(using=using), \
+                    open_snapshot(options['path'], 'r') as source:
+                self.clear(connection, models, options['replace'])
+                for model, columns, rows in read_snapshot(source, connection.vendor):
+                    count = 0
+                    while True:
+                        batch = list(islice(rows, options['batch_size']))
+                        if not batch:
+                            break
+                        count += insert_rows(model, columns, batch, using=using, raw=True)
+                        self.stdout.write(f"{model._meta.label_lower}: {count}")
+                    loaded[model] = count
+
+                # Rows elsewhere may have pointed at rows --replace deleted
+                self.stdout.write("Checking foreign keys")
+                connection.check_constraints(table_names=None if options['replace'] else [
+                    model._meta.db_table for model in loaded])
+                with connection.cursor() as cursor:
+                    for sql in connection.ops.sequence_reset_sql(no_style(), list(loaded)):
+                        cursor.execute(sql)
+                self.stdout.write("Rebuilding sales counters, search index and caches")
+                rebuild_derived()
+        except (SnapshotError, IntegrityError, ValueError) as error:
+            raise CommandError(f"Could not load {options['path']}: {error}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Loaded {sum(loaded.values())} row(s) into {len(loaded)} table(s) "
+            f"in {time.perf_counter() - started:.1f}s"))
+
+    @staticmethod
+    def clear(connection, models, replace):
+        """Empty the snapshot tables for --replace, or make sure they are empty"""
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            for model in reversed(models):
+                if replace:
+                    cursor.execute(f"DELETE FROM {quote(model._meta.db_table)}")
+                elif model._default_manager.using(connection.alias).exists():
+                    raise CommandError(
+                        f"{model._meta.label_lower} already has rows; use --replace to delete them")
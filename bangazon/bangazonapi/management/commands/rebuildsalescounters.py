@@ -0,0 +1,55 @@
+"""Management command for rebuilding the stored product sales counters"""
+from collections import defaultdict
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from bangazonapi.models import Product
+
+# Keeps each pk__in list under SQLite's bound parameter limit
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    """Recount Product.total_sold from OrderProduct history
+
+    Example:
+        python manage.py rebuildsalescounters
+        python manage.py rebuildsalescounters --check
+    """
+
+    help = "Rebuild Product.total_sold from completed orders, or verify it with --check."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help="Report counters that differ from a fresh recount without changing them.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            recount = Product.count_sales()
+
+            # Only products whose stored counter is wrong get written,
+            # grouped by their correct value so each group is one UPDATE
+            stale = defaultdict(list)
+            stored_counters = Product.objects.values_list('id', 'total_sold').order_by()
+            for product_id, stored in stored_counters.iterator():
+                actual = recount.get(product_id, 0)
+                if stored != actual:
+                    stale[actual].append(product_id)
+                    if options['check']:
+                        self.stdout.write(
+                            f"Product {product_id}: stored {stored}, recounted {actual}")
+
+            mismatches = sum(len(product_ids) for product_ids in stale.values())
+
+            if options['check']:
+                if mismatches:
+                    raise CommandError(f"{mismatches} sales counter(s) out of date")
+                self.stdout.write(self.style.SUCCESS("All sales counters match"))
+                return
+
+            for actual, product_ids in stale.items():
+                for start in range(0, len(product_ids), BATCH_SIZE):
+                    Product.objects.filter(
+                        pk__in=product_ids[start:start + BATCH_SIZE]).update(total_sold=actual)
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {mismatches} sales counter(s)"))
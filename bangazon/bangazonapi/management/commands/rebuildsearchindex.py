@@ -0,0 +1,19 @@
+"""Management command for rebuilding the product full-text search index"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from bangazonapi.models.productsearch import rebuild_search_index
+
+
+class Command(BaseCommand):
+    """Drop and refill the product search index from the product table
+
+    Example:
+        python manage.py rebuildsearchindex
+    """
+
+    help = "Rebuild the full-text search index over product names and descriptions."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            indexed = rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} product(s)"))
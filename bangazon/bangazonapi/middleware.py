@@ -0,0 +1,188 @@
+"""Per-endpoint query and latency instrumentation
+
+QueryInstrumentationMiddleware times every request and, through a
+database execute wrapper, every SQL query it runs. DEBUG is not needed.
+For each endpoint (HTTP method plus URL name, such as `GET product-list`)
+it keeps:
+
+    requests, queries, db_ms, app_ms, render_ms, total_ms, bytes
+        -- running sums and maxima, with mean and p50/p95 over recent requests
+    n_plus_one
+        -- requests that ran one query shape N_PLUS_ONE_THRESHOLD or more times
+
+app_ms is time in Python outside the database, which covers building
+serializer data; render_ms is turning the response into bytes.
+
+Settings:
+    SERVER_TIMING -- add a Server-Timing header with db, app, render and total
+    QUERY_BUDGETS -- dict of endpoint to the most queries one request may run
+    QUERY_BUDGET_STRICT -- raise QueryBudgetExceeded on an overrun or an N+1
+        instead of logging a warning; meant for the test settings
+
+Queries run while a StreamingHttpResponse is consumed are not counted.
+"""
+import logging
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+from bangazonapi.percentiles import percentile
+
+logger = logging.getLogger(__name__)
+
+# Times one query shape may repeat in a request before it counts as N+1
+N_PLUS_ONE_THRESHOLD = 5
+
+# Requests per endpoint kept for the percentiles
+RECENT_REQUESTS = 500
+
+_lock = threading.Lock()
+_endpoints = {}
+
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised in strict mode when a request runs more queries than its budget allows"""
+
+
+def query_shape(sql):
+    """SQL with parameters already left as placeholders and IN lists folded to one"""
+    return _IN_LIST.sub('IN (...)', sql)
+
+
+class _Recorder:
+    """Execute wrapper collecting one request's queries"""
+
+    def __init__(self):
+        self.shapes = Counter()
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
+            self.shapes[query_shape(sql)] += 1
+
+
+def _record(endpoint, sample, repeated):
+    with _lock:
+        stats = _endpoints.get(endpoint)
+        if stats is None:
+            stats = _endpoints[endpoint] = {
+                'requests': 0, 'n_plus_one': 0, 'repeated_shapes': {},
+                'sums': Counter(), 'max': Counter(),
+                'recent_total_ms': deque(maxlen=RECENT_REQUESTS),
+            }
+        stats['requests'] += 1
+        for name, value in sample.items():
+            stats['sums'][name] += value
+            stats['max'][name] = max(stats['max'][name], value)
+        stats['recent_total_ms'].append(sample['total_ms'])
+        if repeated:
+            stats['n_plus_one'] += 1
+            stats['repeated_shapes'].update(repeated)
+
+
+def stats():
+    """Recorded numbers for every endpoint seen since start-up or reset()
+
+    Returns:
+        dict -- endpoint to requests, mean and max of each measure,
+            p50/p95 total_ms, and N+1 counts with the repeated query shapes
+    """
+    with _lock:
+        result = {}
+        for endpoint, stats in sorted(_endpoints.items()):
+            requests = stats['requests']
+            entry = {'requests': requests, 'n_plus_one': stats['n_plus_one']}
+            for name, total in stats['sums'].items():
+                entry[f"mean_{name}"] = total / requests
+                entry[f"max_{name}"] = stats['max'][name]
+            recent = stats['recent_total_ms']
+            entry['p50_total_ms'] = percentile(recent, 0.50)
+            entry['p95_total_ms'] = percentile(recent, 0.95)
+            entry['repeated_shapes'] = dict(stats['repeated_shapes'])
+            result[endpoint] = entry
+        return result
+
+
+def reset():
+    """Forget every recorded request"""
+    with _lock:
+        _endpoints.clear()
+
+
+class QueryInstrumentationMiddleware:
+    """Count queries and time each request, flag N+1 shapes and enforce budgets"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = _Recorder()
+        request._render_started = None
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        total = time.perf_counter() - started
+
+        match = request.resolver_match
+        if match is None:
+            return response
+        endpoint = f"{request.method} {match.view_name}"
+
+        render = 0.0
+        if request._render_started is not None:
+            render = started + total - request._render_started
+        sample = {
+            'queries': recorder.count,
+            'db_ms': recorder.seconds * 1000,
+            'app_ms': max(0.0, total - recorder.seconds - render) * 1000,
+            'render_ms': render * 1000,
+            'total_ms': total * 1000,
+            'bytes': 0 if response.streaming else len(response.content),
+        }
+        repeated = {shape: times for shape, times in recorder.shapes.items()
+                    if times >= N_PLUS_ONE_THRESHOLD}
+        _record(endpoint, sample, repeated)
+
+        if getattr(settings, 'SERVER_TIMING', False):
+            response['Server-Timing'] = ", ".join([
+                f'db;dur={sample["db_ms"]:.1f};desc="{recorder.count} queries"',
+                f'app;dur={sample["app_ms"]:.1f}',
+                f'render;dur={sample["render_ms"]:.1f}',
+                f'total;dur={sample["total_ms"]:.1f}',
+            ])
+
+        self.check_budget(endpoint, recorder.count, repeated)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses render after this hook returns, inside get_response
+        request._render_started = time.perf_counter()
+        return response
+
+    @staticmethod
+    def check_budget(endpoint, queries, repeated):
+        problems = []
+        budget = getattr(settings, 'QUERY_BUDGETS', {}).get(endpoint)
+        if budget is not None and queries > budget:
+            problems.append(f"{endpoint} ran {queries} queries, budget is {budget}")
+        for shape, times in repeated.items():
+            problems.append(f"{endpoint} ran this query {times} times (N+1): {shape[:200]}")
+        if not problems:
+            return
+        if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+            raise QueryBudgetExceeded("; ".join(problems))
+        for problem in problems:
+            logger.warning(problem)
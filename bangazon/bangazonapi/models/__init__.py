@@ -3,4 +3,6 @@ from .order import Order
 from .orderproduct import OrderProduct
 from .paymenttype import PaymentType
 from .product import Product
-from .producttype import ProductType
\ No newline at end of file
+from .producttype import ProductType
+from .tableversion import TableVersion
+from .productsearch import search_products
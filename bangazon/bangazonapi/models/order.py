@@ -1,6 +1,11 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, FloatField, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.dispatch import Signal
 from .customer import Customer
+from .orderproduct import OrderProduct
 from .paymenttype import PaymentType
+from .product import Product, products_updated
 
 class Order(models.Model):
 
@@ -8,17 +13,123 @@ class Order(models.Model):
     Author: Galaydia Team
     Purpose: Single source of information about Order Data with essential fields to be stored in database.
     This model maps to a Order database table.
-    Method: None
+    total and item_count are frozen at checkout and stay empty on an open order.
+    A customer has at most one open order (no payment type), their cart.
+    Method: open_cart, checkout, compute_totals
 
     """
 
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
     payment_type = models.ForeignKey(PaymentType, blank=True, null=True, on_delete=models.DO_NOTHING)
     created_at = models.DateTimeField(auto_now_add=True, blank=True, null=True)
+    total = models.FloatField(blank=True, null=True)
+    item_count = models.PositiveIntegerField(blank=True, null=True)
 
 
     class Meta:
         ordering = ("customer", )
         verbose_name = ("order")
         verbose_name_plural = ("orders")
+        constraints = [
+            # Partial unique index: backs the open cart lookup and stops
+            # concurrent add-to-cart calls from opening a second cart
+            models.UniqueConstraint(fields=['customer'], condition=Q(payment_type__isnull=True),
+                                    name='order_one_open_cart_per_customer'),
+        ]
 
+    @staticmethod
+    def open_cart(user_id, create=False, queryset=None):
+        """The open order of a user's customer, found with one indexed query
+
+        Arguments:
+            user_id -- id of the authenticated user
+            create -- open a cart when the customer has none
+            queryset -- Order queryset to read from, for select_related or only()
+        Returns:
+            Order -- the customer's open order
+        Raises:
+            Order.DoesNotExist -- when there is no cart and create is False
+        """
+        carts = (queryset if queryset is not None else Order.objects.all()).filter(
+            customer__user_id=user_id, payment_type__isnull=True)
+        try:
+            return carts.get()
+        except Order.DoesNotExist:
+            if not create:
+                raise
+
+        customer_id = Customer.objects.values_list('pk', flat=True).get(user_id=user_id)
+        try:
+            with transaction.atomic():
+                return Order.objects.create(customer_id=customer_id)
+        except IntegrityError:
+            # A concurrent request opened the cart first
+            return carts.get()
+
+    def checkout(self, payment_type_id):
+        """Pay for the order and take its products out of stock in one transaction
+
+        The order is claimed with a conditional UPDATE, so two concurrent
+        checkouts of the same cart cannot both succeed, and stock moves
+        with Product.sell, so concurrent checkouts cannot oversell. If any
+        line is out of stock nothing is written. Each line's price is
+        frozen into unit_price and the order's total and item_count are
+        stored, so later price changes never rewrite history.
+
+        Arguments:
+            payment_type_id -- payment type paying for the order
+        Raises:
+            OrderCompleted -- when the order was already paid for
+            OutOfStock -- when a product has fewer units than the order holds
+        """
+        with transaction.atomic():
+            claimed = Order.objects.filter(pk=self.pk, payment_type__isnull=True).update(
+                payment_type_id=payment_type_id)
+            if not claimed:
+                raise OrderCompleted(f"Order {self.pk} has already been paid for")
+
+            units_sold = (OrderProduct.objects
+                          .filter(order_id=self.pk)
+                          .values('product_id')
+                          .annotate(units=Sum('quantity'))
+                          .order_by())
+            units_sold = {row['product_id']: row['units'] for row in units_sold}
+            Product.sell(units_sold)
+
+            price = Product.objects.filter(pk=OuterRef('product_id')).values('price')
+            OrderProduct.objects.filter(order_id=self.pk).update(unit_price=Subquery(price))
+            totals = self.compute_totals()
+            Order.objects.filter(pk=self.pk).update(**totals)
+
+            self.payment_type_id = payment_type_id
+            self.total = totals['total']
+            self.item_count = totals['item_count']
+            transaction.on_commit(lambda: self._send_checkout_signals(units_sold))
+
+    def compute_totals(self):
+        """Sum the order's lines in one aggregate query
+
+        Lines priced at checkout use their frozen unit_price; lines still
+        in a cart use the product's current price.
+
+        Returns:
+            dict -- total price and item_count in units
+        """
+        price = Coalesce('unit_price', 'product__price')
+        totals = OrderProduct.objects.filter(order_id=self.pk).aggregate(
+            total=Sum(F('quantity') * price, output_field=FloatField()),
+            item_count=Sum('quantity'))
+        return {'total': totals['total'] or 0, 'item_count': totals['item_count'] or 0}
+
+    def _send_checkout_signals(self, units_sold):
+        # queryset.update() skips post_save, so tell the caches directly
+        products_updated.send(sender=Product, product_ids=list(units_sold))
+        order_completed.send(sender=Order, order=self)
+
+
+class OrderCompleted(Exception):
+    """Raised when checking out an order that already has a payment type"""
+
+
+# Sent once a checkout has committed
+order_completed = Signal(providing_args=["order"])
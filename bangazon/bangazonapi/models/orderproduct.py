@@ -1,21 +1,158 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Count, F, IntegerField, Min, Sum, Value, When
 
 """
 Author: Galaydia Team
 Purpose: Single source of information about Product Orders Data with essential fields to be stored in database.
 This model maps to a Order Product database table.
-Method: None
+Each row is one line of an order: a product and how many units of it.
+unit_price is the product's price frozen at checkout, empty while in a cart.
+Lines of an order that has been paid for are never changed.
+Method: check_open, add, remove, change_many, collapse_duplicates
 
 """
 class OrderProduct(models.Model):
 
     order = models.ForeignKey("Order", on_delete=models.CASCADE, related_name="cart")
     product= models.ForeignKey("Product", on_delete=models.CASCADE, related_name="cart")
+    quantity = models.PositiveIntegerField(default=1)
+    unit_price = models.FloatField(blank=True, null=True)
 
     class Meta:
         ordering = ("order", )
         verbose_name = ("orderproduct")
         verbose_name_plural = ("orderproducts")
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'product'], name='orderproduct_order_product_unique'),
+        ]
 
+    @staticmethod
+    def check_open(order_id):
+        """Make sure an order is still a cart before its lines change
 
+        Raises:
+            Order.DoesNotExist -- when there is no such order
+            OrderCompleted -- when the order has been paid for
+        """
+        # order.py imports this module, so its names are looked up here
+        from .order import Order, OrderCompleted  # pylint: disable=import-outside-toplevel
+        payment_type_id = Order.objects.filter(pk=order_id).values_list('payment_type_id', flat=True)
+        if not payment_type_id:
+            raise Order.DoesNotExist(f"Order {order_id} does not exist")
+        if payment_type_id[0] is not None:
+            raise OrderCompleted(f"Order {order_id} has already been paid for")
 
+    @staticmethod
+    def add(order_id, product_id, quantity=1):
+        """Add units of a product to an order, creating its line if needed
+
+        An upsert: the line is bumped in place with an UPDATE, and only
+        inserted when the order does not hold the product yet. A concurrent
+        insert of the same line trips the unique constraint and is retried
+        as an UPDATE. Only lines of an open order are bumped, and the
+        order is checked before inserting, so a paid order keeps the
+        lines its total was frozen from.
+
+        Arguments:
+            order_id -- order to add to
+            product_id -- product to add
+            quantity -- units to add
+        Raises:
+            OrderCompleted -- when the order has been paid for
+        """
+        lines = OrderProduct.objects.filter(
+            order_id=order_id, product_id=product_id, order__payment_type__isnull=True)
+        if lines.update(quantity=F('quantity') + quantity):
+            return
+        with transaction.atomic():
+            OrderProduct.check_open(order_id)
+            try:
+                with transaction.atomic():
+                    OrderProduct.objects.create(
+                        order_id=order_id, product_id=product_id, quantity=quantity)
+            except IntegrityError:
+                lines.update(quantity=F('quantity') + quantity)
+
+    @staticmethod
+    def remove(order_id, product_id, quantity=1):
+        """Take units of a product off an order, dropping its line at zero
+
+        Arguments:
+            order_id -- order to remove from
+            product_id -- product to remove
+            quantity -- units to remove
+        Returns:
+            bool -- False when the order did not hold the product
+        """
+        lines = OrderProduct.objects.filter(order_id=order_id, product_id=product_id)
+        with transaction.atomic():
+            removed = lines.filter(quantity__gt=quantity).update(quantity=F('quantity') - quantity)
+            if not removed:
+                removed, _ = lines.delete()
+        return bool(removed)
+
+    @staticmethod
+    def change_many(order_id, add=None, remove=()):
+        """Add and remove many products on an order in a constant number of queries
+
+        Removed lines go in one DELETE, lines the order already holds are
+        bumped in one UPDATE with a CASE per product, and new lines go in
+        one bulk INSERT. Removals apply before additions. Call it inside a
+        transaction so the change lands all at once.
+
+        Arguments:
+            order_id -- order to change
+            add -- dict of product id to units to add
+            remove -- product ids whose lines are dropped entirely
+        Returns:
+            tuple -- number of lines added, bumped and removed
+        Raises:
+            OrderCompleted -- when the order has been paid for
+        """
+        OrderProduct.check_open(order_id)
+        add = add or {}
+        lines = OrderProduct.objects.filter(order_id=order_id)
+
+        removed = 0
+        if remove:
+            removed, _ = lines.filter(product_id__in=remove).delete()
+
+        existing = set(lines.filter(product_id__in=add).values_list('product_id', flat=True))
+        if existing:
+            lines.filter(product_id__in=existing).update(quantity=F('quantity') + Case(
+                *[When(product_id=product_id, then=Value(add[product_id])) for product_id in existing],
+                output_field=IntegerField()))
+
+        OrderProduct.objects.bulk_create([
+            OrderProduct(order_id=order_id, product_id=product_id, quantity=quantity)
+            for product_id, quantity in add.items() if product_id not in existing
+        ])
+        return len(add) - len(existing), len(existing), removed
+
+    @staticmethod
+    def collapse_duplicates():
+        """Merge repeated (order, product) rows into one line per product
+
+        Carts used to hold one row per unit. The first row of each group
+        keeps the summed quantity and the rest are deleted, so the unique
+        constraint on (order, product) can be added afterwards.
+
+        Returns:
+            int -- number of rows deleted
+        """
+        duplicates = (OrderProduct.objects
+                      .values('order_id', 'product_id')
+                      .annotate(rows=Count('id'), units=Sum('quantity'), keep=Min('id'))
+                      .filter(rows__gt=1)
+                      .order_by())
+
+        deleted = 0
+        with transaction.atomic():
+            for group in duplicates:
+                OrderProduct.objects.filter(pk=group['keep']).update(quantity=group['units'])
+                extra, _ = (OrderProduct.objects
+                            .filter(order_id=group['order_id'], product_id=group['product_id'])
+                            .exclude(pk=group['keep'])
+                            .delete())
+                deleted += extra
+        return deleted
@@ -1,5 +1,8 @@
+from collections import defaultdict
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from django.db.models import F, Sum
+from django.dispatch import Signal
 from .customer import Customer
 from .producttype import ProductType
 from .orderproduct import OrderProduct
@@ -8,7 +11,7 @@ from .orderproduct import OrderProduct
 Author: Galaydia Team
 Purpose: Single source of information about Product Data with essential fields to be stored in database.
 This model maps to a Product database table.
-Method: None
+Method: sell, count_sales, newest
 
 """
 class Product(models.Model):
@@ -21,12 +24,95 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, blank=True, null=True)
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
     product_type = models.ForeignKey(ProductType, on_delete=models.DO_NOTHING)
+    # Units sold on completed orders. Maintained at checkout so listing
+    # products never has to count OrderProduct rows; rebuild it with
+    # `python manage.py rebuildsalescounters`.
+    total_sold = models.IntegerField(default=0)
 
     class Meta:
         ordering = ("product_type", )
         verbose_name = ("product")
         verbose_name_plural = ("products")
+        # Catalog filters on category or location always test stock too
+        indexes = [
+            models.Index(fields=["product_type", "quantity"], name="product_type_quantity_idx"),
+            models.Index(fields=["location", "quantity"], name="product_location_quantity_idx"),
+            # Newest-first listings walk these backwards and stop after N rows
+            models.Index(fields=["created_at"], name="product_created_at_idx"),
+            models.Index(fields=["product_type", "created_at"], name="product_type_created_at_idx"),
+        ]
 
-    @property
-    def total_sold(self):
-        return OrderProduct.objects.filter(product=self, order__payment_type__isnull=False).count()
\ No newline at end of file
+    @staticmethod
+    def sell(units_by_product):
+        """Take sold units out of stock and add them to the sales counters
+
+        Each UPDATE only matches products that still have enough stock, so
+        concurrent sales can never drive a quantity below zero. Products
+        selling the same number of units share one UPDATE, so the cost
+        grows with the distinct unit counts, not with the cart. Call it
+        inside a transaction so a failed sale rolls back the ones before it.
+
+        Arguments:
+            units_by_product -- dict of product id to units sold
+        Raises:
+            OutOfStock -- when any product has fewer units than requested
+        """
+        products_by_units = defaultdict(list)
+        for product_id, units in units_by_product.items():
+            products_by_units[units].append(product_id)
+
+        for units, product_ids in products_by_units.items():
+            updated = Product.objects.filter(pk__in=product_ids, quantity__gte=units).update(
+                quantity=F('quantity') - units, total_sold=F('total_sold') + units)
+            if updated < len(product_ids):
+                short = Product.objects.filter(pk__in=product_ids, quantity__lt=units)
+                raise OutOfStock(sorted(short.values_list('id', flat=True)))
+
+    @staticmethod
+    def count_sales():
+        """Recount units sold per product from OrderProduct history
+
+        Returns:
+            dict -- product id to units sold on completed orders
+        """
+        sales = (OrderProduct.objects
+                 .filter(order__payment_type__isnull=False)
+                 .values('product_id')
+                 .annotate(units=Sum('quantity'))
+                 .order_by())
+        return {row['product_id']: row['units'] for row in sales}
+
+    @staticmethod
+    def newest(limit, category=None):
+        """Most recently created products, newest first
+
+        Runs ORDER BY created_at DESC LIMIT N on the created_at indexes.
+
+        Arguments:
+            limit -- number of products to return, capped at NEWEST_MAX
+            category -- optional product type id
+        Returns:
+            list -- Product instances with customer, user and product type loaded
+        """
+        limit = max(min(int(limit), NEWEST_MAX), 0)
+        queryset = Product.objects.select_related(
+            'customer__user', 'product_type').prefetch_related(
+                'customer__user__groups', 'customer__user__user_permissions')
+        if category is not None:
+            queryset = queryset.filter(product_type_id=category)
+        return list(queryset.order_by('-created_at', '-id')[:limit])
+
+
+class OutOfStock(Exception):
+    """Raised when a sale asks for more units than a product has in stock"""
+
+    def __init__(self, product_ids):
+        super().__init__(f"Not enough stock for product(s) {product_ids}")
+        self.product_ids = product_ids
+
+
+# Sent after products are changed with queryset.update(), which skips
+# post_save, so caches of product data can still drop them
+products_updated = Signal(providing_args=["product_ids"])
+
+NEWEST_MAX = 100
@@ -0,0 +1,194 @@
+import re
+from django.db import connections, router
+from django.db.models import Q
+from django.db.models.signals import post_migrate, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from .product import Product
+
+"""
+Author: Galaydia Team
+Purpose: Full-text search over product names and descriptions.
+On SQLite this is an FTS5 virtual table keyed by product id, kept in sync
+by the Product save/delete signals. Other backends fall back to icontains.
+The table is external content: it reads the text back from the product
+table instead of holding a second copy, so removing an entry has to name
+the text it was indexed with. Names and descriptions must therefore only
+change through save(), never queryset.update().
+Method: search_products, rebuild_search_index, ensure_search_index
+
+"""
+
+SEARCH_TABLE = "bangazonapi_product_search"
+
+# Matches in the name count for more than matches in the description
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+# Matches ranked per search, newest products first. Ranking every match
+# of a common word costs hundreds of ms at a million products; results
+# past this many are not returned.
+SEARCH_CANDIDATES = 1000
+
+# Prefix indexes keep "dog*" style queries off a full term scan
+SEARCH_TABLE_SQL = (
+    f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5("
+    f"name, description, content='{Product._meta.db_table}', content_rowid='id', "
+    "tokenize='porter unicode61', prefix='2 3 4')")
+
+
+def _connection():
+    return connections[router.db_for_write(Product)]
+
+
+def _uses_fts(connection):
+    return connection.vendor == 'sqlite'
+
+
+def ensure_search_index(connection=None):
+    """Create the FTS5 table if it does not exist yet or has another definition
+
+    Returns:
+        bool -- True when the table had to be created and needs filling
+    """
+    connection = connection or _connection()
+    if not _uses_fts(connection):
+        return False
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sql FROM sqlite_master WHERE name = %s", [SEARCH_TABLE])
+        row = cursor.fetchone()
+        if row and row[0] == SEARCH_TABLE_SQL:
+            return False
+        if row:
+            cursor.execute(f"DROP TABLE {SEARCH_TABLE}")
+        cursor.execute(SEARCH_TABLE_SQL)
+    return True
+
+
+def rebuild_search_index(connection=None):
+    """Repopulate the search index from the product table in one pass
+
+    Returns:
+        int -- number of products indexed
+    """
+    connection = connection or _connection()
+    if not _uses_fts(connection):
+        return 0
+
+    ensure_search_index(connection)
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('rebuild')")
+        # Merge the b-trees written by the rebuild for faster queries
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+        cursor.execute(f"SELECT COUNT(*) FROM {Product._meta.db_table}")
+        indexed = cursor.fetchone()[0]
+    return indexed
+
+
+def _match_expression(text):
+    # Quote every word so user input can never be read as FTS5 syntax,
+    # and prefix-match the words so partial typing still finds results
+    words = re.findall(r"\w+", text)
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def search_products(text, limit, offset=0):
+    """Find products matching every word of the text, best match first
+
+    On SQLite only the SEARCH_CANDIDATES newest matches are ranked, so a
+    common word costs the same however many products contain it.
+
+    Arguments:
+        text -- free text search query
+        limit -- maximum number of products to return
+        offset -- number of ranked results to skip
+    Returns:
+        list -- Product instances with customer, user and product type loaded
+    """
+    products = Product.objects.select_related(
+        'customer__user', 'product_type').prefetch_related(
+            'customer__user__groups', 'customer__user__user_permissions')
+
+    connection = _connection()
+    if not _uses_fts(connection):
+        matches = Q()
+        for word in text.split():
+            matches &= Q(name__icontains=word) | Q(description__icontains=word)
+        return list(products.filter(matches).order_by('name', 'id')[offset:offset + limit])
+
+    expression = _match_expression(text)
+    if not expression:
+        return []
+
+    with connection.cursor() as cursor:
+        # FTS5 walks matches in rowid order, so the inner LIMIT stops early
+        cursor.execute(
+            f"SELECT rowid FROM (SELECT rowid, bm25({SEARCH_TABLE}, %s, %s) AS score "
+            f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s ORDER BY rowid DESC LIMIT %s) "
+            "ORDER BY score, rowid DESC LIMIT %s OFFSET %s",
+            [NAME_WEIGHT, DESCRIPTION_WEIGHT, expression, SEARCH_CANDIDATES, limit, offset])
+        ranked_ids = [row[0] for row in cursor.fetchall()]
+
+    found = products.in_bulk(ranked_ids)
+    return [found[product_id] for product_id in ranked_ids if product_id in found]
+
+
+def _unindex(cursor, product_id, name, description):
+    # An external content entry is removed by naming the text it was indexed with
+    cursor.execute(
+        f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, name, description) "
+        "VALUES ('delete', %s, %s, %s)", [product_id, name, description])
+
+
+@receiver(pre_save, sender=Product)
+def remember_indexed_text(sender, instance, using, **kwargs):
+    """Read the text a product is indexed with before the save overwrites it"""
+    instance._indexed_text = None
+    if instance.pk is None or not _uses_fts(connections[using]):
+        return
+    instance._indexed_text = Product.objects.using(using).filter(pk=instance.pk).values_list(
+        'name', 'description').first()
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, using, **kwargs):
+    """Replace the search entry of a saved product when its text changed"""
+    connection = connections[using]
+    if not _uses_fts(connection):
+        return
+
+    indexed = getattr(instance, '_indexed_text', None)
+    text = (instance.name, instance.description)
+    if indexed == text:
+        return
+    with connection.cursor() as cursor:
+        if indexed is not None:
+            _unindex(cursor, instance.pk, *indexed)
+        cursor.execute(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, name, description) VALUES (%s, %s, %s)",
+            [instance.pk, *text])
+
+
+@receiver(pre_delete, sender=Product)
+def unindex_product(sender, instance, using, **kwargs):
+    """Remove a product from the search index while its row still holds the indexed text"""
+    connection = connections[using]
+    if not _uses_fts(connection):
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, name, description) "
+            f"SELECT 'delete', id, name, description FROM {Product._meta.db_table} "
+            "WHERE id = %s", [instance.pk])
+
+
+@receiver(post_migrate)
+def create_search_index(sender, app_config, using, **kwargs):
+    """Create and fill the search table alongside the bangazonapi tables"""
+    if app_config.label != Product._meta.app_label:
+        return
+
+    connection = connections[using]
+    if ensure_search_index(connection):
+        rebuild_search_index(connection)
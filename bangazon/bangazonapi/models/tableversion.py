@@ -0,0 +1,95 @@
+from django.contrib.auth.models import User
+from django.db import models
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from .customer import Customer
+from .order import Order, order_completed
+from .paymenttype import PaymentType
+from .product import Product, products_updated
+from .producttype import ProductType
+
+"""
+Author: Galaydia Team
+Purpose: Change counter per table, bumped by save/delete signals.
+Conditional GETs build their ETag and Last-Modified from these rows
+instead of reading or serializing the data they describe.
+This model maps to a Table Version database table.
+Method: bump, current
+
+"""
+
+class TableVersion(models.Model):
+
+    table = models.CharField(max_length=50, unique=True)
+    version = models.BigIntegerField(default=0)
+    modified_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ("table", )
+        verbose_name = ("tableversion")
+        verbose_name_plural = ("tableversions")
+
+    @staticmethod
+    def bump(*tables):
+        """Record a change to each of the tables"""
+        now = timezone.now()
+        updated = TableVersion.objects.filter(table__in=tables).update(
+            version=F('version') + 1, modified_at=now)
+        if updated < len(tables):
+            # current() reports a missing row as version 0, so a new row
+            # starts at 1 for this change to move the ETag
+            for table in tables:
+                TableVersion.objects.get_or_create(
+                    table=table, defaults={'version': 1, 'modified_at': now})
+
+    @staticmethod
+    def current(*tables):
+        """Read the versions of the tables in one query
+
+        Returns:
+            tuple -- (list of versions in table order, latest modified_at or None)
+        """
+        rows = {row.table: row for row in TableVersion.objects.filter(table__in=tables)}
+        versions = [rows[table].version if table in rows else 0 for table in tables]
+        modified = [row.modified_at for row in rows.values()]
+        return versions, max(modified) if modified else None
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(products_updated)
+def product_changed(sender, **kwargs):
+    TableVersion.bump('product')
+
+
+@receiver(post_save, sender=ProductType)
+@receiver(post_delete, sender=ProductType)
+def product_type_changed(sender, **kwargs):
+    TableVersion.bump('producttype')
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+@receiver(order_completed)
+def order_changed(sender, **kwargs):
+    TableVersion.bump('order')
+
+
+@receiver(post_save, sender=PaymentType)
+@receiver(post_delete, sender=PaymentType)
+def payment_type_changed(sender, **kwargs):
+    TableVersion.bump('paymenttype')
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def customer_changed(sender, **kwargs):
+    # Responses embed the customer together with its user, so one row covers both
+    if kwargs.get('action', 'post_').startswith('post_'):
+        TableVersion.bump('customer')
@@ -0,0 +1,18 @@
+"""Percentiles shared by the request instrumentation and the benchmark commands
+
+One formula everywhere, so the numbers in /stats and in the benchmark
+reports can be compared directly.
+"""
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty collection of numbers
+
+    Arguments:
+        values -- numbers in any order
+        fraction -- 0.5 for the median, 0.95 for p95 and so on
+    Returns:
+        the value at position round(fraction * (len - 1)) of the sorted values
+    """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
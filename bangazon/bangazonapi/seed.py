@@ -0,0 +1,257 @@
+"""Deterministic synthetic data for benchmarks and local environments
+
+seed_database fills the bangazonapi tables at a chosen scale, writing
+batches of plain rows through bangazonapi.bulk.insert_rows with ids
+assigned up front, in foreign key order. The same arguments and random seed always produce
+the same rows, so benchmark runs on different commits see identical data
+(ids match too when the database starts empty).
+
+Popularity is skewed like real traffic: products are picked for orders,
+and customers place them, with Zipf-like weights 1 / rank ** skew over a
+seeded shuffle, so a few products and customers account for most
+orders. created_at values are spread over the year before SEED_EPOCH in
+id order instead of all being the moment of the insert.
+
+Every seeded user's password is PASSWORD and their token key is derived
+from the seed and their position, so clients can authenticate without
+extra lookups.
+"""
+import hashlib
+import random
+from bisect import bisect
+from datetime import date, datetime, timedelta
+from itertools import accumulate
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from bangazonapi.bulk import insert_rows, next_id, rebuild_derived
+from bangazonapi.models import Customer, Order, OrderProduct, PaymentType, Product, ProductType
+
+PASSWORD = 'bangazon'
+
+PRODUCT_TYPES = ('Pets', 'Electronics', 'Books', 'Garden', 'Kitchen', 'Toys',
+                 'Clothing', 'Sports', 'Music', 'Tools', 'Beauty', 'Grocery')
+LOCATIONS = ('Nashville', 'Memphis', 'Knoxville', 'Chattanooga', 'Louisville',
+             'Atlanta', 'Birmingham', 'Austin')
+ADJECTIVES = ('Fluffy', 'Compact', 'Rugged', 'Classic', 'Deluxe', 'Portable',
+              'Vintage', 'Smart', 'Organic', 'Handmade', 'Wireless', 'Giant')
+NOUNS = ('Dog', 'Lamp', 'Kettle', 'Guitar', 'Drone', 'Novel', 'Shovel', 'Jacket',
+         'Blender', 'Puzzle', 'Speaker', 'Backpack', 'Camera', 'Helmet', 'Teapot')
+MERCHANTS = ('Visa', 'Mastercard', 'Amex', 'Discover')
+
+DEFAULT_BATCH_SIZE = 2000
+
+# Zipf exponent for product and customer popularity; 0 is uniform
+DEFAULT_SKEW = 1.0
+
+# Seeded rows are dated within the year before this, so reruns match
+SEED_EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+SEED_SPAN = timedelta(days=365)
+
+
+def token_key(random_seed, position):
+    """Token key of the seeded customer at a position, 40 hex characters like DRF's"""
+    return hashlib.sha1(f"bangazon-seed:{random_seed}:{position}".encode()).hexdigest()
+
+
+def _batches(count, batch_size):
+    for start in range(0, count, batch_size):
+        yield range(start, min(count, start + batch_size))
+
+
+def _created_at(position, count):
+    return SEED_EPOCH - SEED_SPAN + SEED_SPAN * (position + 1) / max(count, 1)
+
+
+class Popularity:
+    """Weighted picks over range(count) with weight 1 / rank ** skew
+
+    Ranks are assigned by a seeded shuffle so the popular positions are
+    scattered rather than the lowest ids.
+    """
+
+    def __init__(self, generator, count, skew):
+        self.random = generator
+        self.count = count
+        self.by_rank = list(range(count))
+        generator.shuffle(self.by_rank)
+        self.cum_weights = list(accumulate(1 / (rank + 1) ** skew for rank in range(count)))
+        self.total = self.cum_weights[-1] if count else 0
+
+    def pick(self):
+        # What random.choices does for one pick, without its per-call setup
+        rank = bisect(self.cum_weights, self.random.random() * self.total, 0, self.count - 1)
+        return self.by_rank[rank]
+
+    def distinct(self, count):
+        """count different positions, or all of them when there are fewer"""
+        count = min(count, self.count)
+        picks, seen = [], set()
+        # Strong skew keeps drawing the same few; fall back to uniform then
+        for _ in range(count * 4):
+            if len(picks) == count:
+                return picks
+            position = self.pick()
+            if position not in seen:
+                seen.add(position)
+                picks.append(position)
+        if count * 2 > self.count:
+            # Most positions are wanted, so listing the rest is no waste
+            rest = [position for position in range(self.count) if position not in seen]
+            return picks + self.random.sample(rest, count - len(picks))
+        # Uniform draws mostly miss the few picks, without listing all positions
+        while len(picks) < count:
+            position = self.random.randrange(self.count)
+            if position not in seen:
+                seen.add(position)
+                picks.append(position)
+        return picks
+
+
+class Seeder:
+    """Writes one seeded dataset; seed_database is the entry point"""
+
+    def __init__(self, random_seed, batch_size, skew, log):
+        self.random = random.Random(random_seed)
+        self.random_seed = random_seed
+        self.batch_size = batch_size
+        self.skew = skew
+        self.log = log
+        self.user_offset = User.objects.count()
+        # Ids are contiguous from the next free one, so position i of a
+        # table is id first + i and rows can reference each other directly
+        self.customer_ids = range(0)
+        self.payment_type_ids = range(0)
+        self.product_ids = range(0)
+        self.product_prices = []
+        self.order_lines = 0
+
+    def customers(self, count):
+        password = make_password(PASSWORD, salt=f"seed{self.random_seed}")
+        offset = self.user_offset
+        first_user, first_customer, first_payment_type = (
+            next_id(User), next_id(Customer), next_id(PaymentType))
+        expires = date(2030, 1, 1)
+        for batch in _batches(count, self.batch_size):
+            joined = [_created_at(i, count) for i in batch]
+            insert_rows(User, ('id', 'username', 'email', 'password', 'first_name', 'last_name',
+                               'date_joined'), [
+                (first_user + i, f"customer{offset + i}", f"customer{offset + i}@example.com",
+                 password, self.random.choice(ADJECTIVES), self.random.choice(NOUNS), when)
+                for i, when in zip(batch, joined)])
+            insert_rows(Customer, ('id', 'user_id', 'address', 'phone_number'), [
+                (first_customer + i, first_user + i,
+                 f"{100 + i} {self.random.choice(LOCATIONS)} Ave", f"555-{i % 10000:04d}")
+                for i in batch])
+            insert_rows(Token, ('key', 'user_id', 'created'), [
+                (token_key(self.random_seed, offset + i), first_user + i, when)
+                for i, when in zip(batch, joined)])
+            insert_rows(PaymentType, ('id', 'merchant_name', 'account_number', 'expiration_date',
+                                      'customer_id', 'created_at'), [
+                (first_payment_type + i, self.random.choice(MERCHANTS),
+                 f"{self.random.randrange(10 ** 15, 10 ** 16)}",
+                 expires + timedelta(days=self.random.randrange(1000)), first_customer + i, when)
+                for i, when in zip(batch, joined)])
+            self.log(f"customers: {batch.stop}/{count}")
+        self.customer_ids = range(first_customer, first_customer + count)
+        self.payment_type_ids = range(first_payment_type, first_payment_type + count)
+
+    def products(self, count):
+        type_ids = list(ProductType.objects.values_list('pk', flat=True))
+        if not type_ids:
+            first_type = next_id(ProductType)
+            insert_rows(ProductType, ('id', 'name'),
+                        [(first_type + i, name) for i, name in enumerate(PRODUCT_TYPES)])
+            type_ids = list(range(first_type, first_type + len(PRODUCT_TYPES)))
+        first_product = next_id(Product)
+        for batch in _batches(count, self.batch_size):
+            rows = []
+            for i in batch:
+                noun = self.random.choice(NOUNS)
+                price = round(self.random.uniform(1, 500), 2)
+                rows.append((
+                    first_product + i, f"{self.random.choice(ADJECTIVES)} {noun} {i}", price,
+                    f"A {noun.lower()} from the {self.random.choice(LOCATIONS)} warehouse",
+                    self.random.randrange(0, 500), self.random.choice(LOCATIONS),
+                    self.random.choice(self.customer_ids), self.random.choice(type_ids),
+                    _created_at(i, count)))
+                self.product_prices.append(price)
+            insert_rows(Product, ('id', 'name', 'price', 'description', 'quantity', 'location',
+                                  'customer_id', 'product_type_id', 'created_at'), rows)
+            self.log(f"products: {batch.stop}/{count}")
+        self.product_ids = range(first_product, first_product + count)
+
+    def orders(self, count, lines_per_order, open_carts):
+        products = Popularity(self.random, len(self.product_ids), self.skew)
+        customers = Popularity(self.random, len(self.customer_ids), self.skew)
+        # The first customers get the open carts; one each, as the
+        # partial unique index on open orders requires. They come last
+        # so they are the newest orders.
+        open_carts = min(open_carts, count, len(self.customer_ids))
+        completed = count - open_carts
+        first_order, first_line = next_id(Order), next_id(OrderProduct)
+        for batch in _batches(count, self.batch_size):
+            orders, lines = [], []
+            for i in batch:
+                is_open = i >= completed
+                position = i - completed if is_open else customers.pick()
+                picks = products.distinct(self.random.randint(1, lines_per_order * 2 - 1))
+                units = [self.random.randint(1, 3) for _ in picks]
+                prices = [self.product_prices[pick] for pick in picks]
+                if is_open:
+                    orders.append((first_order + i, self.customer_ids[position], None,
+                                   _created_at(i, count), None, None))
+                else:
+                    orders.append((first_order + i, self.customer_ids[position],
+                                   self.payment_type_ids[position], _created_at(i, count),
+                                   round(sum(price * unit for price, unit in zip(prices, units)), 2),
+                                   sum(units)))
+                for pick, unit, price in zip(picks, units, prices):
+                    lines.append((first_line + self.order_lines, first_order + i,
+                                  self.product_ids[pick], unit, None if is_open else price))
+                    self.order_lines += 1
+
+            insert_rows(Order, ('id', 'customer_id', 'payment_type_id', 'created_at', 'total',
+                                'item_count'), orders)
+            insert_rows(OrderProduct, ('id', 'order_id', 'product_id', 'quantity', 'unit_price'),
+                        lines)
+            self.log(f"orders: {batch.stop}/{count}")
+
+
+def seed_database(customers=100, products=1000, orders=1000, lines_per_order=3,
+                  open_carts=None, random_seed=0, skew=DEFAULT_SKEW,
+                  batch_size=DEFAULT_BATCH_SIZE, log=None):
+    """Fill the database with a deterministic synthetic dataset
+
+    Arguments:
+        customers -- users, each with a customer, token and payment type
+        products -- products spread over PRODUCT_TYPES
+        orders -- orders; lines per order average lines_per_order
+        open_carts -- how many of the orders are open carts, one per
+            customer starting with the first; a tenth of the customers by default
+        random_seed -- seed making the data reproducible
+        skew -- Zipf exponent of product and customer popularity, 0 for uniform
+        batch_size -- rows generated and written per step
+        log -- optional callable receiving progress lines
+    Returns:
+        dict -- row counts and the first seeded customer's user id and token key
+    """
+    if open_carts is None:
+        open_carts = max(1, customers // 10)
+    seeder = Seeder(random_seed, batch_size, skew, log or (lambda message: None))
+    with transaction.atomic():
+        seeder.customers(customers)
+        seeder.products(products)
+        seeder.orders(orders, lines_per_order, open_carts)
+        rebuild_derived()
+
+    return {
+        'customers': len(seeder.customer_ids),
+        'products': len(seeder.product_ids),
+        'orders': orders,
+        'order_lines': seeder.order_lines,
+        'user_id': Customer.objects.get(pk=seeder.customer_ids[0]).user_id,
+        'token': token_key(random_seed, seeder.user_offset),
+    }
@@ -0,0 +1,155 @@
+"""Compact database snapshots for seeding environments
+
+A snapshot is gzip-compressed JSON lines. The first line describes the
+snapshot; then each table starts with an object line naming its model
+and columns, followed by one array line per row:
+
+    {"snapshot": 1, "vendor": "sqlite", "created": "2020-01-01T00:00:00+00:00"}
+    {"model": "bangazonapi.producttype", "columns": ["id", "name"]}
+    [1,"Pets"]
+    [2,"Electronics"]
+
+Rows hold the values as the database stores them, read with a plain
+cursor, so they are written back without conversion; that ties a
+snapshot to the database vendor it was taken from. Dates and times,
+which the driver hands back parsed, are written with str(), the text
+form SQLite stores them in. Tables come in foreign key order, parents
+first.
+
+Users come with their groups and their group and permission
+memberships. Permissions and content types are not copied: migrate
+creates them, and loading checks that every referenced one exists.
+"""
+import gzip
+import json
+from django.apps import apps
+from django.contrib.auth.models import Group, User
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from bangazonapi.models import TableVersion
+
+FORMAT_VERSION = 1
+
+# Rows fetched from the database per round trip
+CHUNK_SIZE = 2000
+
+# Rebuilt by rebuild_derived instead of being copied
+DERIVED_MODELS = (TableVersion,)
+
+
+class SnapshotError(Exception):
+    """Raised when a snapshot file cannot be read or does not fit the database"""
+
+
+def snapshot_models():
+    """Models a snapshot holds, parents before the models pointing at them"""
+    included = [User, Group, Token, User.groups.through, User.user_permissions.through,
+                Group.permissions.through]
+    included += [model for model in apps.get_app_config('bangazonapi').get_models()
+                 if model not in DERIVED_MODELS]
+    ordered = []
+
+    def visit(model):
+        if model in ordered:
+            return
+        for field in model._meta.concrete_fields:
+            parent = field.related_model
+            if field.is_relation and parent in included and parent is not model:
+                visit(parent)
+        ordered.append(model)
+
+    for model in included:
+        visit(model)
+    return ordered
+
+
+def _columns(model):
+    return [field.attname for field in model._meta.concrete_fields]
+
+
+def open_snapshot(path, mode):
+    """Open a snapshot file for text reading or writing, gzipped unless it ends in .jsonl"""
+    if path.endswith('.jsonl'):
+        return open(path, mode + 't', encoding='utf-8')
+    return gzip.open(path, mode + 't', encoding='utf-8', compresslevel=6)
+
+
+def write_snapshot(output, using=DEFAULT_DB_ALIAS, log=None):
+    """Write every snapshot table to a text stream
+
+    Returns:
+        dict -- model label to rows written
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    dumps = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False, default=str).encode
+    output.write(dumps({'snapshot': FORMAT_VERSION, 'vendor': connection.vendor,
+                        'created': timezone.now().isoformat()}) + '\n')
+
+    counts = {}
+    for model in snapshot_models():
+        columns = _columns(model)
+        output.write(dumps({'model': model._meta.label_lower, 'columns': columns}) + '\n')
+        sql = (f"SELECT {', '.join(quote(field.column) for field in model._meta.concrete_fields)} "
+               f"FROM {quote(model._meta.db_table)} ORDER BY {quote(model._meta.pk.column)}")
+        written = 0
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+            while True:
+                rows = cursor.fetchmany(CHUNK_SIZE)
+                if not rows:
+                    break
+                output.write(''.join(dumps(row) + '\n' for row in rows))
+                written += len(rows)
+        counts[model._meta.label_lower] = written
+        if log:
+            log(f"{model._meta.label_lower}: {written}")
+    return counts
+
+
+def read_snapshot(source, vendor):
+    """Yield (model, columns, rows) for each table in a snapshot text stream
+
+    rows is an iterator of tuples and must be consumed before the next
+    table is yielded.
+
+    Arguments:
+        source -- text stream of the snapshot
+        vendor -- vendor of the database being loaded, which must match
+    """
+    header = source.readline()
+    try:
+        header = json.loads(header)
+    except ValueError:
+        raise SnapshotError("Not a snapshot: the first line is not JSON")
+    if not isinstance(header, dict) or header.get('snapshot') != FORMAT_VERSION:
+        raise SnapshotError(f"Not a version {FORMAT_VERSION} snapshot")
+    if header.get('vendor') != vendor:
+        raise SnapshotError(f"Snapshot was taken from {header.get('vendor')}, not {vendor}")
+
+    known = {model._meta.label_lower: model for model in snapshot_models()}
+    pending = None
+    while True:
+        line = pending or source.readline()
+        pending = None
+        if not line:
+            return
+        table = json.loads(line)
+        model = known.get(table.get('model')) if isinstance(table, dict) else None
+        if model is None:
+            raise SnapshotError(f"Unexpected table line: {line[:200]}")
+        if table['columns'] != _columns(model):
+            raise SnapshotError(
+                f"{table['model']} columns {table['columns']} do not match the database's; "
+                "take the snapshot again after migrating")
+
+        def rows():
+            nonlocal pending
+            for line in source:
+                if line.startswith('{'):
+                    pending = line
+                    return
+                yield tuple(json.loads(line))
+
+        yield model, table['columns'], rows()
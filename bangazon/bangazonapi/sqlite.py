@@ -0,0 +1,64 @@
+"""SQLite connection tuning
+
+Every new SQLite connection runs the PRAGMAs in settings.SQLITE_PRAGMAS
+through the connection_created signal. The defaults in settings.py are
+the production profile:
+
+    journal_mode=WAL -- readers keep reading the last committed data while
+        a writer appends to the write-ahead log, instead of waiting on it
+    synchronous=NORMAL -- fsync at checkpoints rather than every commit;
+        with WAL a power cut can lose the last commits but never corrupts
+    busy_timeout -- a writer waits this many ms for the write lock rather
+        than failing straight away with "database is locked"
+    mmap_size, cache_size -- read pages through memory-mapped I/O and keep
+        more of them cached per connection
+    temp_store=MEMORY -- sorts and temporary indexes stay off the disk
+
+journal_mode is stored in the database file; the others last for the
+connection, which CONN_MAX_AGE keeps open across requests. In-memory
+databases, as used by the tests, report journal_mode=memory and ignore
+the WAL setting.
+"""
+import logging
+import re
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+_PRAGMA_NAME = re.compile(r'^[a-z_]+$')
+
+
+def _check_name(name):
+    if not _PRAGMA_NAME.match(name):
+        raise ValueError(f"Not a PRAGMA name: {name!r}")
+
+
+def pragma_values(connection, names):
+    """Current value of each named PRAGMA on a Django SQLite connection"""
+    connection.ensure_connection()
+    values = {}
+    for name in names:
+        _check_name(name)
+        row = connection.connection.execute(f"PRAGMA {name}").fetchone()
+        values[name] = row[0] if row else None
+    return values
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """Apply settings.SQLITE_PRAGMAS to each new SQLite connection"""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    if not pragmas:
+        return
+    # The raw sqlite3 connection, so these stay out of query counts
+    database = connection.connection
+    for name, value in pragmas.items():
+        _check_name(name)
+        row = database.execute(f"PRAGMA {name} = {value}").fetchone()
+        if name == 'journal_mode' and row and row[0] not in (str(value).lower(), 'memory'):
+            logger.warning("SQLite stayed in journal_mode=%s instead of %s for %s",
+                           row[0], value, connection.settings_dict['NAME'])
@@ -1,3 +1,795 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import random
+import tempfile
+import threading
+from unittest import mock
+from datetime import date
+from io import StringIO
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, Permission, User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models.query import QuerySet
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from bangazonapi import authentication, cache, hashing
+from bangazonapi.models import (Customer, Order, OrderProduct, PaymentType, Product, ProductType,
+                                TableVersion, search_products)
+from bangazonapi.models import productsearch
+from bangazonapi.models.order import OrderCompleted
+from bangazonapi.views.order import BULK_CART_MAX
+from bangazonapi.percentiles import percentile
+from bangazonapi.seed import Popularity
 
-# Create your tests here.
+
+class ApiTestCase(TestCase):
+    """TestCase with an authenticated customer and empty caches"""
+
+    def setUp(self):
+        for alias in ('default', 'catalog', 'auth'):
+            caches[alias].clear()
+        self.user = User.objects.create_user(username='shopper', password='bangazon')
+        self.customer = Customer.objects.create(
+            user=self.user, address='100 Infinity Way', phone_number='555-1212')
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=self.user).key}")
+        self.product_type = ProductType.objects.create(name='Kitchen')
+        self.payment_type = PaymentType.objects.create(
+            merchant_name='Visa', account_number='4111111111111111',
+            expiration_date=date(2030, 1, 1), customer=self.customer)
+
+    def make_product(self, name='Kettle', price=20.0, quantity=10):
+        return Product.objects.create(
+            name=name, price=price, description=f"A {name.lower()}", quantity=quantity,
+            location='Nashville', customer=self.customer, product_type=self.product_type)
+
+
+class TableVersionTests(ApiTestCase):
+
+    def test_first_bump_moves_past_missing_row(self):
+        TableVersion.objects.all().delete()
+        self.assertEqual(TableVersion.current('producttype')[0], [0])
+        TableVersion.bump('producttype')
+        self.assertEqual(TableVersion.current('producttype')[0], [1])
+
+    def test_first_change_to_empty_table_changes_etag(self):
+        TableVersion.objects.all().delete()
+        first = self.client.get('/producttypes')
+        self.assertEqual(first.status_code, 200)
+
+        ProductType.objects.create(name='Garden')
+
+        second = self.client.get('/producttypes', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+
+    def test_customer_change_moves_product_etags(self):
+        product = self.make_product()
+        for url in ('/products', f"/products/{product.pk}", f"/producttypes/{self.product_type.pk}"):
+            with self.subTest(url):
+                first = self.client.get(url)
+                self.customer.address = f"{self.customer.address} {url}"
+                self.customer.save()
+                second = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+                self.assertEqual(second.status_code, 200)
+                self.assertNotEqual(second['ETag'], first['ETag'])
+
+    def test_user_change_moves_product_etag(self):
+        self.make_product()
+        first = self.client.get('/products')
+
+        self.user.first_name = 'Renamed'
+        self.user.save()
+
+        second = self.client.get('/products', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+
+
+class CartQuantityTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.kettle = self.make_product()
+
+    def test_add_to_cart_rejects_bad_quantities(self):
+        for quantity in (0, -1, 'abc', None, 2.5, '2.5', True, False):
+            response = self.client.post(
+                '/orders', {'product_id': self.kettle.pk, 'quantity': quantity}, format='json')
+            self.assertEqual(response.status_code, 400, quantity)
+        self.assertFalse(OrderProduct.objects.exists())
+
+    def test_bulk_add_rejects_fractions_and_booleans(self):
+        for quantity in (1.9, True):
+            response = self.client.post(
+                '/orders/bulk', {'add': [{'product_id': self.kettle.pk, 'quantity': quantity}]},
+                format='json')
+            self.assertEqual(response.status_code, 400, quantity)
+        self.assertFalse(OrderProduct.objects.exists())
+
+    def test_bulk_body_must_be_an_object(self):
+        for body in ([1, 2], 'add', 3):
+            response = self.client.post('/orders/bulk', body, format='json')
+            self.assertEqual(response.status_code, 400, body)
+
+    def test_add_to_cart_adds_units(self):
+        for quantity in (2, 3.0):
+            response = self.client.post(
+                '/orders', {'product_id': self.kettle.pk, 'quantity': quantity}, format='json')
+            self.assertEqual(response.status_code, 204)
+        line = OrderProduct.objects.get()
+        self.assertEqual(line.quantity, 5)
+
+    def test_order_products_reject_bad_quantities(self):
+        order = Order.objects.create(customer=self.customer)
+        for quantity in (0, -1, 'abc', 2.5, True):
+            response = self.client.post(
+                '/orderproducts', {'order': order.pk, 'product': self.kettle.pk,
+                                   'quantity': quantity}, format='json')
+            self.assertEqual(response.status_code, 400, quantity)
+        self.assertFalse(OrderProduct.objects.exists())
+
+
+class ListOrderingTests(ApiTestCase):
+
+    def test_order_pages_are_newest_first_without_overlap(self):
+        order_ids = [Order.objects.create(customer=self.customer, payment_type=self.payment_type).pk
+                     for _ in range(5)]
+        seen = []
+        for offset in (0, 2, 4):
+            response = self.client.get('/orders', {'limit': 2, 'offset': offset})
+            seen += [order['id'] for order in response.data['results']]
+        self.assertEqual(seen, sorted(order_ids, reverse=True))
+
+    def test_order_product_pages_are_newest_first_without_overlap(self):
+        order = Order.objects.create(customer=self.customer)
+        line_ids = [OrderProduct.objects.create(order=order, product=self.make_product(f"Pan {i}")).pk
+                    for i in range(5)]
+        seen = []
+        for offset in (0, 2, 4):
+            response = self.client.get('/orderproducts', {'limit': 2, 'offset': offset})
+            seen += [line['id'] for line in response.data['results']]
+        self.assertEqual(seen, sorted(line_ids, reverse=True))
+
+
+class SnapshotTests(ApiTestCase):
+
+    def test_replace_round_trips_users_with_groups_and_permissions(self):
+        self.user.user_permissions.add(Permission.objects.get(codename='add_product'))
+        group = Group.objects.create(name='Merchants')
+        group.permissions.add(Permission.objects.get(codename='change_product'))
+        self.user.groups.add(group)
+        kettle = self.make_product()
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'snapshot.gz')
+            call_command('dumpsnapshot', path, stdout=StringIO())
+            call_command('loadsnapshot', path, '--replace', stdout=StringIO())
+
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(list(user.user_permissions.values_list('codename', flat=True)),
+                         ['add_product'])
+        self.assertEqual(list(user.groups.values_list('name', flat=True)), ['Merchants'])
+        self.assertEqual(list(Group.objects.get().permissions.values_list('codename', flat=True)),
+                         ['change_product'])
+        self.assertEqual(Product.objects.get().name, kettle.name)
+
+
+class CatalogCacheTests(ApiTestCase):
+
+    def test_customer_change_reaches_cached_product_pages(self):
+        product = self.make_product()
+        pages = {
+            '/products': lambda data: data[0]['customer'],
+            f"/products/{product.pk}": lambda data: data['customer'],
+            f"/producttypes/{self.product_type.pk}": lambda data: data['product_set'][0]['customer'],
+        }
+        for url in pages:
+            self.client.get(url)
+        self.assertEqual(cache.stats()['misses'], 3)
+
+        self.customer.address = '1 New Street'
+        self.customer.save()
+
+        for url, customer in pages.items():
+            with self.subTest(url):
+                self.assertEqual(customer(self.client.get(url).data)['address'], '1 New Street')
+        self.assertEqual(cache.stats()['hits'], 0)
+
+    def test_user_change_reaches_cached_product_list(self):
+        self.make_product()
+        self.client.get('/products')
+
+        self.user.first_name = 'Renamed'
+        self.user.save()
+
+        self.assertEqual(self.client.get('/products').data[0]['customer']['user']['first_name'],
+                         'Renamed')
+
+    def test_newest_products_follow_product_and_customer_changes(self):
+        product = self.make_product()
+        self.client.get('/products/newest')
+        self.assertEqual(self.client.get('/products/newest').data[0]['name'], product.name)
+        self.assertEqual(cache.stats()['hits'], 1)
+
+        product.name = 'Renamed kettle'
+        product.save()
+        self.assertEqual(self.client.get('/products/newest').data[0]['name'], 'Renamed kettle')
+
+        self.customer.address = '1 New Street'
+        self.customer.save()
+        self.assertEqual(self.client.get('/products/newest').data[0]['customer']['address'],
+                         '1 New Street')
+        self.assertEqual(cache.stats()['hits'], 1)
+
+
+class ProductListTests(ApiTestCase):
+
+    def test_quantity_must_be_a_whole_number_of_at_least_zero(self):
+        for quantity in ('-1', 'abc', '1.5'):
+            response = self.client.get('/products', {'quantity': quantity})
+            self.assertEqual(response.status_code, 400, quantity)
+
+    def test_category_must_be_a_product_type_id(self):
+        for category in ('abc', '0', '1.5'):
+            response = self.client.get('/products', {'category': category})
+            self.assertEqual(response.status_code, 400, category)
+
+    def test_category_and_location_filter(self):
+        kettle = self.make_product()
+        other_type = ProductType.objects.create(name='Garden')
+        Product.objects.filter(pk=self.make_product('Hose').pk).update(product_type=other_type)
+        response = self.client.get('/products', {'category': str(self.product_type.pk),
+                                                 'location': 'Nashville'})
+        self.assertEqual([product['id'] for product in response.data], [kettle.pk])
+
+    def test_quantity_limits_to_newest_products(self):
+        products = [self.make_product(f"Pot {i}") for i in range(3)]
+        response = self.client.get('/products', {'quantity': '2'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([product['id'] for product in response.data],
+                         [product.pk for product in reversed(products[1:])])
+
+
+@override_settings(PASSWORD_HASHING_WORKERS=1)
+class HashingAdmissionTests(TestCase):
+
+    def setUp(self):
+        # The semaphore is built on first use from the settings in force
+        hashing._slots = None
+        self.addCleanup(setattr, hashing, '_slots', None)
+
+    def test_calls_past_the_workers_are_refused_without_waiting(self):
+        started, release = threading.Event(), threading.Event()
+
+        def slow_hash():
+            started.set()
+            release.wait(5)
+            return 'hash'
+
+        results = []
+        holder = threading.Thread(target=lambda: results.append(hashing.run('login', slow_hash)))
+        holder.start()
+        self.assertTrue(started.wait(5))
+        try:
+            with self.assertRaises(hashing.HashingBusy):
+                hashing.run('login', str)
+        finally:
+            release.set()
+            holder.join()
+        self.assertEqual(results, ['hash'])
+        self.assertEqual(hashing.run('login', str, 1), '1')
+
+    @override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.PBKDF2PasswordHasher',
+                                          'django.contrib.auth.hashers.MD5PasswordHasher'])
+    def test_saturated_upgrade_does_not_fail_a_verified_login(self):
+        user = User.objects.create(username='shopper',
+                                   password=make_password('bangazon', hasher='md5'))
+        Token.objects.create(user=user)
+        real_run = hashing.run
+
+        def busy_for_new_hashes(endpoint, function, *args):
+            if function is make_password:
+                raise hashing.HashingBusy("busy")
+            return real_run(endpoint, function, *args)
+
+        login = {'username': 'shopper', 'password': 'bangazon'}
+        with mock.patch.object(hashing, 'run', busy_for_new_hashes):
+            response = self.client.post('/login', login, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(json.loads(response.content)['valid'])
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('md5$'))
+
+        self.client.post('/login', login, content_type='application/json')
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$'))
+
+
+class CheckoutTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.kettle = self.make_product('Kettle', price=20.0, quantity=10)
+        self.pan = self.make_product('Pan', price=5.0, quantity=10)
+        self.cart = Order.open_cart(self.user.pk, create=True)
+
+    def checkout(self, order=None):
+        order = order or self.cart
+        return self.client.put(f"/orders/{order.pk}", {'payment_type': self.payment_type.pk},
+                               format='json')
+
+    def test_checkout_sells_stock_and_freezes_prices(self):
+        OrderProduct.add(self.cart.pk, self.kettle.pk, 2)
+        OrderProduct.add(self.cart.pk, self.pan.pk)
+
+        self.assertEqual(self.checkout().status_code, 204)
+
+        self.kettle.refresh_from_db()
+        self.pan.refresh_from_db()
+        self.assertEqual((self.kettle.quantity, self.kettle.total_sold), (8, 2))
+        self.assertEqual((self.pan.quantity, self.pan.total_sold), (9, 1))
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.payment_type_id, self.payment_type.pk)
+        self.assertEqual((self.cart.total, self.cart.item_count), (45.0, 3))
+
+        Product.objects.filter(pk=self.kettle.pk).update(price=99.0)
+        self.assertEqual(OrderProduct.objects.get(product=self.kettle).unit_price, 20.0)
+        self.assertEqual(self.cart.compute_totals()['total'], 45.0)
+
+    def test_out_of_stock_checkout_is_409_and_changes_nothing(self):
+        OrderProduct.add(self.cart.pk, self.kettle.pk, 11)
+        OrderProduct.add(self.cart.pk, self.pan.pk, 2)
+
+        response = self.checkout()
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['product_ids'], [self.kettle.pk])
+        self.cart.refresh_from_db()
+        self.assertIsNone(self.cart.payment_type_id)
+        self.assertIsNone(self.cart.total)
+        for product in (self.kettle, self.pan):
+            product.refresh_from_db()
+            self.assertEqual((product.quantity, product.total_sold), (10, 0))
+        self.assertFalse(OrderProduct.objects.filter(unit_price__isnull=False).exists())
+
+    def test_second_checkout_is_409_and_sells_once(self):
+        OrderProduct.add(self.cart.pk, self.kettle.pk, 3)
+        self.assertEqual(self.checkout().status_code, 204)
+
+        self.assertEqual(self.checkout().status_code, 409)
+
+        self.kettle.refresh_from_db()
+        self.assertEqual((self.kettle.quantity, self.kettle.total_sold), (7, 3))
+
+    def test_stale_instance_cannot_claim_a_paid_order(self):
+        OrderProduct.add(self.cart.pk, self.kettle.pk)
+        stale = Order.objects.get(pk=self.cart.pk)
+        self.cart.checkout(self.payment_type.pk)
+
+        with self.assertRaises(OrderCompleted):
+            stale.checkout(self.payment_type.pk)
+        self.kettle.refresh_from_db()
+        self.assertEqual(self.kettle.quantity, 9)
+
+    def test_completed_orders_revalidate_after_product_and_customer_changes(self):
+        OrderProduct.add(self.cart.pk, self.kettle.pk)
+        self.cart.checkout(self.payment_type.pk)
+        first = self.client.get('/orders/completed')
+        self.assertEqual(first.data[0]['lines'][0]['product']['name'], 'Kettle')
+
+        self.kettle.name = 'Renamed'
+        self.kettle.save()
+        second = self.client.get('/orders/completed', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data[0]['lines'][0]['product']['name'], 'Renamed')
+
+        self.customer.address = '1 New Street'
+        self.customer.save()
+        third = self.client.get('/orders/completed', HTTP_IF_NONE_MATCH=second['ETag'])
+        self.assertEqual(third.status_code, 200)
+        self.assertEqual(third.data[0]['customer']['address'], '1 New Street')
+
+    def test_checkout_of_unknown_order_is_404(self):
+        self.assertEqual(self.checkout(Order(pk=self.cart.pk + 100)).status_code, 404)
+
+
+class CartUpsertTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.kettle = self.make_product()
+        self.cart = Order.open_cart(self.user.pk, create=True)
+
+    def test_add_raises_the_existing_line(self):
+        OrderProduct.add(self.cart.pk, self.kettle.pk)
+        OrderProduct.add(self.cart.pk, self.kettle.pk, 4)
+
+        line = OrderProduct.objects.get()
+        self.assertEqual((line.order_id, line.product_id, line.quantity),
+                         (self.cart.pk, self.kettle.pk, 5))
+
+    def test_add_after_a_concurrent_insert_updates_instead(self):
+        # Another request inserts the line between this one's UPDATE and INSERT
+        real_update = QuerySet.update
+        calls = []
+
+        def update_then_race(queryset, **kwargs):
+            updated = real_update(queryset, **kwargs)
+            calls.append(updated)
+            if len(calls) == 1:
+                OrderProduct.objects.create(order=self.cart, product=self.kettle, quantity=2)
+            return updated
+
+        with mock.patch('django.db.models.query.QuerySet.update', update_then_race):
+            OrderProduct.add(self.cart.pk, self.kettle.pk, 3)
+
+        self.assertEqual(calls, [0, 1])
+        self.assertEqual(OrderProduct.objects.get().quantity, 5)
+
+    def test_paid_order_lines_cannot_change(self):
+        OrderProduct.add(self.cart.pk, self.kettle.pk)
+        self.cart.checkout(self.payment_type.pk)
+
+        response = self.client.post('/orderproducts', {
+            'order': self.cart.pk, 'product': self.kettle.pk, 'quantity': 5}, format='json')
+        self.assertEqual(response.status_code, 409)
+        with self.assertRaises(OrderCompleted):
+            OrderProduct.add(self.cart.pk, self.make_product('Pan').pk)
+        with self.assertRaises(OrderCompleted):
+            OrderProduct.change_many(self.cart.pk, {self.kettle.pk: 1})
+
+        line = OrderProduct.objects.get()
+        self.cart.refresh_from_db()
+        self.assertEqual((line.quantity, self.cart.item_count, self.cart.total), (1, 1, 20.0))
+
+    def test_open_cart_is_reused(self):
+        self.assertEqual(Order.open_cart(self.user.pk, create=True).pk, self.cart.pk)
+        self.client.post('/orders', {'product_id': self.kettle.pk}, format='json')
+        self.assertEqual(Order.objects.filter(payment_type__isnull=True).count(), 1)
+
+
+@override_settings(QUERY_BUDGET_STRICT=True)
+class QueryBudgetTests(ApiTestCase):
+    """Every endpoint in settings.QUERY_BUDGETS stays within its budget, with no N+1"""
+
+    def setUp(self):
+        super().setUp()
+        # Enough rows that a per-row query would repeat past the N+1 threshold
+        other_type = ProductType.objects.create(name='Garden')
+        self.products = [self.make_product(f"Kettle {i}") for i in range(6)]
+        self.products += [self.make_product(f"Hose {i}") for i in range(6)]
+        Product.objects.filter(name__startswith='Hose').update(product_type=other_type)
+        for _ in range(6):
+            order = Order.objects.create(customer=self.customer)
+            for product in self.products[:3]:
+                OrderProduct.add(order.pk, product.pk)
+            order.checkout(self.payment_type.pk)
+        self.cart = Order.open_cart(self.user.pk, create=True)
+        for product in self.products[:6]:
+            OrderProduct.add(self.cart.pk, product.pk, 2)
+
+    def requests(self):
+        product, product_type = self.products[0], self.product_type
+        return {
+            'GET product-list': ('get', '/products', {}),
+            'GET product-detail': ('get', f"/products/{product.pk}", {}),
+            'GET product-newest': ('get', '/products/newest', {}),
+            'GET product-search': ('get', '/products/search', {'q': 'kettle'}),
+            'GET product-myproduct': ('get', '/products/myproduct', {}),
+            'GET producttype-list': ('get', '/producttypes', {}),
+            'GET producttype-detail': ('get', f"/producttypes/{product_type.pk}", {}),
+            'GET producttype-products': ('get', f"/producttypes/{product_type.pk}/products", {}),
+            'GET order-list': ('get', '/orders', {}),
+            'GET order-current': ('get', '/orders/current', {}),
+            'GET order-cart': ('get', '/orders/cart', {}),
+            'GET order-completed': ('get', '/orders/completed', {}),
+            'GET order-multipleorders': ('get', '/orders/multipleorders', {}),
+            'GET order-carthistory': ('get', '/orders/carthistory', {'order': self.cart.pk}),
+            'POST order-bulk': ('post', '/orders/bulk', {
+                # Lines already in the cart and new ones, the costliest mix
+                'add': [{'product_id': p.pk, 'quantity': 2} for p in self.products[5:]],
+                'remove': [self.products[0].pk]}),
+            'GET customer-list': ('get', '/customers', {}),
+            'GET orderproduct-list': ('get', '/orderproducts', {}),
+            'GET paymenttype-list': ('get', '/paymenttypes', {}),
+        }
+
+    def test_every_budgeted_endpoint_is_covered(self):
+        self.assertEqual(set(self.requests()), set(settings.QUERY_BUDGETS))
+
+    def test_endpoints_stay_within_budget(self):
+        for endpoint, (method, url, data) in self.requests().items():
+            with self.subTest(endpoint):
+                # Budgets count a cold token lookup
+                for alias in ('default', 'auth'):
+                    caches[alias].clear()
+                response = getattr(self.client, method)(url, data, format='json')
+                self.assertEqual(response.status_code, 200, response.content[:200])
+
+
+class ProductSearchTests(ApiTestCase):
+
+    def search(self, text):
+        return [product.pk for product in search_products(text, 10)]
+
+    def assertIndexIntact(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {productsearch.SEARCH_TABLE} "
+                           f"({productsearch.SEARCH_TABLE}, rank) VALUES ('integrity-check', 1)")
+
+    def test_results_follow_saves_and_deletes(self):
+        kettle = self.make_product('Kettle')
+        self.assertEqual(self.search('kett'), [kettle.pk])
+
+        kettle.name, kettle.description = 'Teapot', 'A teapot'
+        kettle.save()
+        self.assertEqual(self.search('kettle'), [])
+        self.assertEqual(self.search('teapot'), [kettle.pk])
+
+        kettle.quantity = 3
+        kettle.save()
+        self.assertEqual(self.search('teapot'), [kettle.pk])
+
+        kettle.delete()
+        self.assertEqual(self.search('teapot'), [])
+        self.assertIndexIntact()
+
+    def test_rebuild_matches_saved_products(self):
+        kettle, pan = self.make_product('Kettle'), self.make_product('Pan')
+        self.assertEqual(productsearch.rebuild_search_index(), 2)
+        self.assertFalse(productsearch.ensure_search_index())
+        self.assertEqual((self.search('kettle'), self.search('pan')), ([kettle.pk], [pan.pk]))
+        self.assertIndexIntact()
+
+    def test_name_matches_rank_first_among_candidates(self):
+        in_description = self.make_product('Pan')
+        Product.objects.filter(pk=in_description.pk).update(description='Goes with a lamp')
+        productsearch.rebuild_search_index()
+        lamp = self.make_product('Lamp')
+        self.assertEqual(self.search('lamp'), [lamp.pk, in_description.pk])
+
+        with mock.patch.object(productsearch, 'SEARCH_CANDIDATES', 1):
+            self.assertEqual(self.search('lamp'), [lamp.pk])
+
+
+class PopularityTests(TestCase):
+
+    def test_distinct_under_strong_skew(self):
+        popularity = Popularity(random.Random(0), 100000, skew=3)
+        for count in (3, 50):
+            picks = popularity.distinct(count)
+            self.assertEqual(len(set(picks)), count)
+            self.assertTrue(all(0 <= position < 100000 for position in picks))
+
+    def test_distinct_takes_everything_when_asked_for_more(self):
+        popularity = Popularity(random.Random(0), 10, skew=3)
+        self.assertEqual(sorted(popularity.distinct(12)), list(range(10)))
+
+
+class SalesCounterTests(ApiTestCase):
+
+    def sell(self, products):
+        order = Order.objects.create(customer=self.customer)
+        for product in products:
+            OrderProduct.add(order.pk, product.pk, 2)
+        order.checkout(self.payment_type.pk)
+
+    def queries(self, url):
+        for alias in ('catalog', 'auth'):
+            caches[alias].clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(queries)
+
+    def test_catalog_query_count_does_not_grow_with_products_or_sales(self):
+        self.sell([self.make_product(f"Kettle {i}") for i in range(2)])
+        few = [self.queries(url) for url in ('/products', f"/producttypes/{self.product_type.pk}")]
+
+        self.sell([self.make_product(f"Pan {i}") for i in range(10)])
+        many = [self.queries(url) for url in ('/products', f"/producttypes/{self.product_type.pk}")]
+
+        self.assertEqual(many, few)
+        self.assertEqual({product['total_sold'] for product in self.client.get('/products').data},
+                         {2})
+
+    def test_rebuild_recounts_stale_counters(self):
+        kettle = self.make_product()
+        self.sell([kettle])
+        Product.objects.filter(pk=kettle.pk).update(total_sold=7)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuildsalescounters', '--check', stdout=StringIO())
+        call_command('rebuildsalescounters', stdout=StringIO())
+
+        kettle.refresh_from_db()
+        self.assertEqual(kettle.total_sold, 2)
+        call_command('rebuildsalescounters', '--check', stdout=StringIO())
+
+
+class SparseFieldsTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.kettle = self.make_product()
+
+    def test_fields_narrow_the_body_and_the_select(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/products/{self.kettle.pk}", {'fields': 'id,name'})
+        self.assertEqual(response.data, {'id': self.kettle.pk, 'name': 'Kettle'})
+        select = next(query['sql'] for query in queries if 'FROM "bangazonapi_product"' in query['sql'])
+        self.assertNotIn('"description"', select)
+
+    def test_dotted_fields_expand_only_what_is_named(self):
+        response = self.client.get('/products', {'fields': 'id,customer.address'})
+        self.assertEqual(response.data, [{'id': self.kettle.pk,
+                                          'customer': {'address': '100 Infinity Way'}}])
+
+    def test_relations_not_expanded_come_back_as_ids(self):
+        response = self.client.get(f"/products/{self.kettle.pk}",
+                                   {'fields': 'customer,product_type', 'expand': 'product_type'})
+        self.assertEqual(response.data['customer'], self.customer.pk)
+        self.assertEqual(response.data['product_type']['name'], 'Kitchen')
+
+    def test_unknown_names_are_rejected(self):
+        for params in ({'fields': 'id,nope'}, {'expand': 'nope'}, {'fields': 'customer.nope'}):
+            with self.subTest(params):
+                caches['catalog'].clear()
+                response = self.client.get(f"/products/{self.kettle.pk}", params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('nope', response.data['detail'])
+
+
+class BulkCartTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.products = [self.make_product(f"Kettle {i}") for i in range(6)]
+        self.cart = Order.open_cart(self.user.pk, create=True)
+        OrderProduct.add(self.cart.pk, self.products[0].pk, 3)
+        OrderProduct.add(self.cart.pk, self.products[1].pk)
+
+    def bulk(self, body):
+        return self.client.post('/orders/bulk', body, format='json')
+
+    def cart_lines(self):
+        return dict(OrderProduct.objects.values_list('product_id', 'quantity'))
+
+    def test_adds_and_removes_in_one_request(self):
+        kettle, pan = self.products[0], self.products[2]
+        response = self.bulk({'add': [{'product_id': kettle.pk, 'quantity': 2},
+                                      {'product_id': pan.pk}, {'product_id': pan.pk}],
+                              'remove': [self.products[1].pk]})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.cart_lines(), {kettle.pk: 5, pan.pk: 2})
+        self.assertEqual({product['id']: product['quantity_in_cart'] for product in response.data},
+                         {kettle.pk: 5, pan.pk: 2})
+
+    def test_any_bad_item_leaves_the_cart_alone(self):
+        before = self.cart_lines()
+        good = {'product_id': self.products[2].pk, 'quantity': 1}
+        bodies = [
+            {'add': [good, {'product_id': 999999}], 'remove': [self.products[0].pk]},
+            {'add': [good, {'product_id': self.products[3].pk, 'quantity': 0}]},
+            {'add': [good, {'quantity': 1}]},
+            {'add': [good], 'remove': ['abc']},
+            {'add': [{'product_id': product_id} for product_id in range(1, BULK_CART_MAX + 2)]},
+        ]
+        for body in bodies:
+            with self.subTest(body):
+                self.assertEqual(self.bulk(body).status_code, 400)
+                self.assertEqual(self.cart_lines(), before)
+
+    def test_unknown_products_are_named(self):
+        response = self.bulk({'add': [{'product_id': 999998}, {'product_id': 999999}]})
+        self.assertEqual(response.data['product_ids'], [999998, 999999])
+
+    def test_query_count_does_not_grow_with_the_bundle(self):
+        def queries(products):
+            with CaptureQueriesContext(connection) as captured:
+                self.bulk({'add': [{'product_id': product.pk} for product in products],
+                           'remove': [self.products[0].pk]})
+            return len(captured)
+
+        self.assertEqual(queries(self.products[2:3]), queries(self.products[1:6]))
+
+
+class TokenCacheTests(ApiTestCase):
+
+    def token_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            status_code = self.client.get('/paymenttypes').status_code
+        return status_code, sum('"authtoken_token"' in query['sql'] for query in queries)
+
+    def test_repeat_requests_skip_the_token_query(self):
+        self.assertEqual(self.token_queries(), (200, 1))
+        self.assertEqual(self.token_queries(), (200, 0))
+
+    def test_deleted_token_stops_authenticating(self):
+        self.token_queries()
+        Token.objects.filter(user=self.user).delete()
+        self.assertEqual(self.token_queries()[0], 401)
+
+    def test_deactivated_user_stops_authenticating(self):
+        self.token_queries()
+        self.assertEqual(self.client.put(f"/customers/{self.customer.pk}").status_code, 204)
+        self.assertEqual(self.token_queries()[0], 401)
+
+    def test_customer_change_refreshes_the_cached_user(self):
+        self.token_queries()
+        self.customer.address = '1 New Street'
+        self.customer.save()
+
+        key = Token.objects.get(user=self.user).key
+        self.assertIsNone(authentication.get_cache().get(authentication._key(key)))
+        self.assertEqual(self.token_queries(), (200, 1))
+
+
+class ExportTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.kettle = kettle = self.make_product()
+        self.paid = Order.objects.create(customer=self.customer)
+        OrderProduct.add(self.paid.pk, kettle.pk, 2)
+        self.paid.checkout(self.payment_type.pk)
+        self.cart = Order.open_cart(self.user.pk, create=True)
+        OrderProduct.add(self.cart.pk, kettle.pk)
+
+    def export(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode('utf-8')
+
+    def test_ndjson_has_one_object_per_row(self):
+        response, body = self.export('/orders/export')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([(row['id'], row['payment_type_id'], row['total']) for row in rows],
+                         [(self.paid.pk, self.payment_type.pk, 40.0), (self.cart.pk, None, None)])
+
+        _, body = self.export('/orders/export', open='true')
+        self.assertEqual([json.loads(line)['id'] for line in body.splitlines()], [self.cart.pk])
+
+    def test_csv_has_a_header_and_one_line_per_row(self):
+        response, body = self.export('/orderproducts/export', output='csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="orderproducts.csv"')
+        rows = list(csv.reader(body.splitlines()))
+        self.assertEqual(rows[0], ['id', 'order_id', 'product_id', 'quantity', 'unit_price'])
+        self.assertEqual([row[1:4] for row in rows[1:]],
+                         [[str(self.paid.pk), str(self.kettle.pk), '2'],
+                          [str(self.cart.pk), str(self.kettle.pk), '1']])
+
+    def test_rows_are_read_while_streaming(self):
+        response = self.client.get('/customers/export', {'output': 'csv'})
+        with CaptureQueriesContext(connection) as queries:
+            lines = iter(response.streaming_content)
+            self.assertTrue(next(lines).startswith(b'id,user_id,username'))
+            self.assertEqual(len(queries), 0)
+            self.assertIn(b'shopper', next(lines))
+        self.assertEqual(len(queries), 1)
+
+    def test_unknown_output_and_non_admins_are_refused(self):
+        self.assertEqual(self.client.get('/orders/export', {'output': 'xml'}).status_code, 400)
+        User.objects.filter(pk=self.user.pk).update(is_staff=False)
+        caches['auth'].clear()
+        self.assertEqual(self.client.get('/orders/export').status_code, 403)
+
+
+class PercentileTests(TestCase):
+
+    def test_nearest_rank_over_the_sorted_values(self):
+        values = [5, 1, 4, 2, 3, 10, 9, 8, 7, 6]
+        self.assertEqual([percentile(values, fraction) for fraction in (0, 0.5, 0.95, 1)],
+                         [1, 5, 10, 10])
+        self.assertEqual(percentile([42], 0.99), 42)
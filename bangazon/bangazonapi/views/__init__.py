@@ -6,3 +6,5 @@ from .orderproduct import OrderProducts
 from .paymenttype import PaymentTypes
 from .product import Products
 from .producttype import ProductTypes
+from .stats import cache_stats, auth_stats, query_stats
+
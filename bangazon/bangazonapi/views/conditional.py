@@ -0,0 +1,48 @@
+"""Conditional GET support shared by the Bangazon ViewSets"""
+import functools
+import hashlib
+from calendar import timegm
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import status
+from bangazonapi.models import TableVersion
+
+
+def conditional_get(*tables, per_user=False):
+    """Decorator answering If-None-Match / If-Modified-Since for a ViewSet method
+
+    The validators come from the TableVersion rows of the tables the
+    response is built from, so an unchanged resource gets a 304 after one
+    small query, before any serializer runs.
+
+    Arguments:
+        tables -- names of the TableVersion rows the response depends on
+        per_user -- True when the response differs between users
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            versions, modified_at = TableVersion.current(*tables)
+
+            # The same data renders differently per URL, renderer and user
+            parts = [request.build_absolute_uri(), request.accepted_renderer.format]
+            parts += [f"{table}:{version}" for table, version in zip(tables, versions)]
+            if per_user:
+                parts.append(f"user:{request.user.pk}")
+            etag = '"%s"' % hashlib.md5("|".join(parts).encode('utf-8')).hexdigest()
+            last_modified = timegm(modified_at.utctimetuple()) if modified_at else None
+
+            not_modified = get_conditional_response(
+                request, etag=etag, last_modified=last_modified)
+            if not_modified is not None:
+                not_modified['ETag'] = etag
+                return not_modified
+
+            response = method(self, request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                response['ETag'] = etag
+                if last_modified is not None:
+                    response['Last-Modified'] = http_date(last_modified)
+            return response
+        return wrapper
+    return decorator
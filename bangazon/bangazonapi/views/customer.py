@@ -1,11 +1,16 @@
 """View module for handling requests about customers"""
 from django.http import HttpResponseServerError
+from rest_framework.decorators import action
+from rest_framework.permissions import IsAdminUser
 from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
 from rest_framework import serializers
 from rest_framework import status
 from django.contrib.auth.models import User
 from bangazonapi.models import Customer
+from .export import export_response
+from .fields import DynamicFieldsMixin, expandable, select_for_request
+from .pagination import list_response
 
 """HyperlinkedModelSerializer class
 Author: Scott Silver
@@ -16,8 +21,8 @@ create() and update() methods by default.
 Methods: GET, PUT, POST, DELETE
 """
 
-class UserSerializer(serializers.HyperlinkedModelSerializer):
-    user = serializers.HyperlinkedRelatedField(many=True, view_name='user-detail', read_only=True)
+@expandable
+class UserSerializer(DynamicFieldsMixin, serializers.HyperlinkedModelSerializer):
     """JSON serializer for users
 
     Arguments:
@@ -30,7 +35,8 @@ class UserSerializer(serializers.HyperlinkedModelSerializer):
                   'last_name', 'email', 'date_joined', 'is_active')
         depth = 1
 
-class CustomerSerializer(serializers.HyperlinkedModelSerializer):
+@expandable
+class CustomerSerializer(DynamicFieldsMixin, serializers.HyperlinkedModelSerializer):
 
     """JSON serializer for customers
 
@@ -65,8 +71,9 @@ class Customers(ViewSet):
         Returns:
             Response -- JSON serialized customer instance
         """
+        customers = select_for_request(Customer.objects.all(), request, CustomerSerializer)
         try:
-            customer = Customer.objects.get(pk=pk)
+            customer = customers.get(pk=pk)
             serializer = CustomerSerializer(customer, context={'request': request})
             return Response(serializer.data)
         except Exception as ex:
@@ -74,13 +81,13 @@ class Customers(ViewSet):
 
     def update(self, request, pk=None):
 
-        """Handle PUT requests for a customer
+        """Handle PUT requests for a customer, deactivating their account
 
             Response -- Empty body with 204 status code
         """
-        customer = Customer.objects.get(pk=pk)
+        customer = Customer.objects.select_related('user').get(pk=pk)
         customer.user.is_active = False
-        customer.save()
+        customer.user.save()
 
         return Response({}, status=status.HTTP_204_NO_CONTENT)
 
@@ -90,10 +97,24 @@ class Customers(ViewSet):
         Returns:
             Response -- JSON serialized list of customers
         """
-        customers = Customer.objects.all()
-        serializer = CustomerSerializer(
-            customers,
-            many=True,
-            context={'request': request}
-        )
-        return Response(serializer.data)
+        customers = Customer.objects.select_related('user').prefetch_related(
+            'user__groups', 'user__user_permissions')
+        return list_response(self, request, customers, CustomerSerializer)
+
+    # Example request:
+    #   http://localhost:8000/customers/export?output=csv
+    @action(methods=['get'], detail=False, permission_classes=[IsAdminUser])
+    def export(self, request):
+        """Handle GET requests streaming every customer with their user's details
+
+        Returns:
+            StreamingHttpResponse -- NDJSON or CSV rows, one per customer
+        """
+        fields = {
+            'id': 'id', 'user_id': 'user_id', 'username': 'user__username',
+            'first_name': 'user__first_name', 'last_name': 'user__last_name',
+            'email': 'user__email', 'is_active': 'user__is_active',
+            'date_joined': 'user__date_joined', 'address': 'address',
+            'phone_number': 'phone_number',
+        }
+        return export_response(request, Customer.objects.order_by('id'), fields, 'customers')
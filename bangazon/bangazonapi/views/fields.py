@@ -0,0 +1,245 @@
+"""Sparse fieldsets and explicit expansion shared by the Bangazon serializers
+
+Clients narrow a response with `?fields=` and choose which relations are
+nested with `?expand=`. Both take comma separated names, and dotted names
+reach into expanded relations:
+
+    /products?fields=id,name,customer.address&expand=customer
+    /orders?expand=payment_type,customer.user
+
+Without either param every serializer keeps its default `depth` nesting.
+A name the serializer does not have is answered with a 400.
+With either param, relations that are not expanded come back as ids, and
+narrow_queryset trims the SQL to the same shape with only(),
+select_related() and prefetch_related(). Declared fields that read a
+relation under another name list their prefetch in `Meta.prefetch`, a
+dict of field name to (lookup, queryset).
+"""
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.exceptions import ParseError
+from rest_framework.utils import model_meta
+
+# Serializer used to expand a relation, keyed by the related model
+EXPANSIONS = {}
+
+_FROM_REQUEST = object()
+
+
+def expandable(serializer_class):
+    """Class decorator registering a serializer as the expansion of its model"""
+    EXPANSIONS[serializer_class.Meta.model] = serializer_class
+    return serializer_class
+
+
+class Selection:
+    """The fields and expanded relations asked for at one level of nesting
+
+    Attributes:
+        fields -- set of field names to keep, or None to keep them all
+        expand -- dict of relation name to the Selection inside it
+    """
+
+    def __init__(self, fields=None, expand=None):
+        self.fields = fields
+        self.expand = expand or {}
+
+    @classmethod
+    def from_paths(cls, field_paths, expand_paths):
+        """Build a Selection tree from dotted field and expand paths"""
+        fields = None
+        if field_paths is not None:
+            fields = {path.split('.')[0] for path in field_paths}
+
+        # A dotted field such as customer.address implies expanding customer
+        expanded = {path.split('.')[0] for path in expand_paths}
+        expanded.update(path.split('.')[0] for path in field_paths or () if '.' in path)
+
+        expand = {}
+        for name in expanded:
+            prefix = name + '.'
+            nested_fields = [path[len(prefix):] for path in field_paths or ()
+                             if path.startswith(prefix)]
+            nested_expand = [path[len(prefix):] for path in expand_paths
+                             if path.startswith(prefix)]
+            expand[name] = cls.from_paths(nested_fields or None, nested_expand)
+
+        return cls(fields, expand)
+
+
+def _split(value):
+    if value is None:
+        return None
+    return [path.strip() for path in value.split(',') if path.strip()]
+
+
+def get_selection(request):
+    """Parse ?fields= and ?expand= from a request
+
+    Returns:
+        Selection -- requested shape, or None when the client asked for neither
+    """
+    if request is None:
+        return None
+    params = request.query_params
+    if 'fields' not in params and 'expand' not in params:
+        return None
+    return Selection.from_paths(_split(params.get('fields')) or None,
+                                _split(params.get('expand')) or [])
+
+
+class DynamicFieldsMixin:
+    """Serializer mixin applying the requested Selection to its fields
+
+    The outermost serializer reads the Selection from the request in its
+    context; expanded relations are built with their part of the tree.
+    """
+
+    def __init__(self, *args, selection=_FROM_REQUEST, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._selection = selection
+
+    @property
+    def selection(self):
+        if self._selection is _FROM_REQUEST:
+            self._selection = get_selection(self.context.get('request'))
+        return self._selection
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selection = self.selection
+        if selection is None:
+            return fields
+
+        unknown = (selection.fields or set()).union(selection.expand).difference(fields)
+        if unknown:
+            raise ParseError(f"Unknown fields: {', '.join(sorted(unknown))}")
+
+        if selection.fields is not None:
+            for name in list(fields):
+                if name not in selection.fields:
+                    del fields[name]
+
+        relations = model_meta.get_field_info(self.Meta.model).relations
+        for name in list(fields):
+            relation = relations.get(name)
+            if relation is None:
+                continue
+
+            serializer_class = EXPANSIONS.get(relation.related_model)
+            if name in selection.expand and serializer_class is not None:
+                fields[name] = serializer_class(
+                    many=relation.to_many, read_only=True, selection=selection.expand[name])
+            else:
+                fields[name] = serializers.PrimaryKeyRelatedField(
+                    many=relation.to_many, read_only=True)
+
+        return fields
+
+
+def _serializer_fields(serializer_class, selection):
+    fields = serializer_class.Meta.fields
+    if fields == serializers.ALL_FIELDS:
+        info = model_meta.get_field_info(serializer_class.Meta.model)
+        fields = set(info.fields) | set(info.forward_relations)
+    if selection.fields is not None:
+        return selection.fields.intersection(fields)
+    return set(fields)
+
+
+def _reverse_relation(model, accessor_name):
+    for relation in model._meta.related_objects:
+        if relation.get_accessor_name() == accessor_name:
+            return relation
+    return None
+
+
+def _plan(model, serializer_class, selection, prefix, plan):
+    # Collect only(), select_related() and prefetch_related() entries for
+    # one level of the selection, following expanded relations downward
+    info = model_meta.get_field_info(model)
+    plan['only'].add(prefix + info.pk.name)
+
+    for name in _serializer_fields(serializer_class, selection):
+        relation = info.relations.get(name)
+        if relation is None:
+            if name in info.fields:
+                plan['only'].add(prefix + name)
+            elif name in getattr(serializer_class.Meta, 'prefetch', {}):
+                lookup, related = serializer_class.Meta.prefetch[name]
+                plan['prefetch'].append(Prefetch(prefix + lookup, queryset=related))
+            continue
+
+        nested_class = EXPANSIONS.get(relation.related_model)
+        expanded = name in selection.expand and nested_class is not None
+
+        if not relation.to_many and not relation.reverse:
+            plan['only'].add(prefix + name)
+            if expanded:
+                plan['select'].append(prefix + name)
+                _plan(relation.related_model, nested_class, selection.expand[name],
+                      prefix + name + '__', plan)
+            continue
+
+        # Reverse and to-many relations always need a prefetch, even when
+        # rendered as ids, or each object would run its own query
+        keep = ()
+        reverse = _reverse_relation(model, name) if relation.reverse else None
+        if reverse is not None and not reverse.many_to_many:
+            # The prefetch joins back to the parent through this foreign key
+            keep = (reverse.field.name,)
+
+        related = relation.related_model.objects.all()
+        if expanded:
+            related = narrow_queryset(related, selection.expand[name], nested_class, keep)
+        else:
+            related = related.only(relation.related_model._meta.pk.name, *keep)
+        plan['prefetch'].append(Prefetch(prefix + name, queryset=related))
+
+
+def narrow_queryset(queryset, selection, serializer_class, keep=()):
+    """Trim a queryset to the columns and joins a Selection will serialize
+
+    Arguments:
+        queryset -- queryset the view would otherwise serialize
+        selection -- Selection from get_selection, or None to leave the queryset alone
+        serializer_class -- DynamicFieldsMixin serializer that will render the rows
+        keep -- extra field names to load even though they are not serialized
+    Returns:
+        QuerySet -- queryset with only(), select_related() and prefetch_related() applied
+    """
+    if selection is None:
+        return queryset
+
+    plan = {'only': set(keep), 'select': [], 'prefetch': []}
+    _plan(queryset.model, serializer_class, selection, '', plan)
+
+    queryset = queryset.select_related(None).prefetch_related(None)
+    if plan['select']:
+        queryset = queryset.select_related(*plan['select'])
+    if plan['prefetch']:
+        queryset = queryset.prefetch_related(*plan['prefetch'])
+    return queryset.only(*plan['only'])
+
+
+def _check_names(serializer):
+    # Building the fields raises for unknown names, level by level
+    fields = serializer.fields
+    for name in serializer.selection.expand:
+        nested = getattr(fields.get(name), 'child', fields.get(name))
+        if isinstance(nested, DynamicFieldsMixin):
+            _check_names(nested)
+
+
+def select_for_request(queryset, request, serializer_class):
+    """Narrow a queryset to the ?fields= and ?expand= of a request
+
+    Returns:
+        QuerySet -- narrowed queryset, or the queryset itself when neither param was sent
+    Raises:
+        ParseError -- when a requested name is not a field of the serializer
+    """
+    selection = get_selection(request)
+    if selection is not None:
+        _check_names(serializer_class(selection=selection))
+    return narrow_queryset(queryset, selection, serializer_class)
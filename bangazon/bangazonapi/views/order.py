@@ -1,15 +1,26 @@
 """View module for handling requests about orders"""
 from django.http import HttpResponseServerError
+from django.db import IntegrityError, transaction
+from django.db.models import F, Prefetch
 from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
 from rest_framework import serializers
 from rest_framework import status
-from bangazonapi.models import Order, Customer, PaymentType, OrderProduct, Product
+from bangazonapi.models import Order, OrderProduct, Product
+from bangazonapi.models.order import OrderCompleted
+from bangazonapi.models.product import OutOfStock
 from rest_framework.decorators import action
+from rest_framework.permissions import IsAdminUser
 from .product import ProductSerializer
+from .conditional import conditional_get
+from .export import export_response
+from .fields import DynamicFieldsMixin, expandable, select_for_request
+from .pagination import list_response
+from .params import query_flag, wants_flat
 
 
-class OrderSerializer(serializers.HyperlinkedModelSerializer):
+@expandable
+class OrderSerializer(DynamicFieldsMixin, serializers.HyperlinkedModelSerializer):
     """
     Author: Scott Silver
     Purpose: JSON serializer for orders to convert native Python datatypes to
@@ -24,10 +35,129 @@ class OrderSerializer(serializers.HyperlinkedModelSerializer):
             view_name='order',
             lookup_field='id'
         )
-        fields = ('id', 'url', 'created_at', 'payment_type', 'customer')
+        fields = ('id', 'url', 'created_at', 'payment_type', 'customer',
+                  'total', 'item_count')
         depth = 2
 
 
+class OrderLineSerializer(serializers.HyperlinkedModelSerializer):
+    """JSON serializer for the line items of an order, with their product
+
+    Arguments:
+        serializers.HyperlinkedModelSerializer
+    """
+
+    class Meta:
+        model = OrderProduct
+        fields = ('id', 'product', 'quantity', 'unit_price')
+        depth = 1
+
+
+# Line items with their products, loaded for a whole page of orders at once
+ORDER_LINES = OrderProduct.objects.select_related('product').order_by('id')
+
+
+class OrderHistorySerializer(OrderSerializer):
+    """JSON serializer for orders with their line items
+
+    Serialize querysets from order_history so no order loads its own rows.
+    """
+    lines = OrderLineSerializer(source='cart', many=True, read_only=True)
+
+    class Meta(OrderSerializer.Meta):
+        fields = OrderSerializer.Meta.fields + ('lines',)
+        prefetch = {'lines': ('cart', ORDER_LINES)}
+
+
+def order_history(orders):
+    """Load everything OrderHistorySerializer nests, in a fixed number of queries
+
+    Customers, users and payment types are joined in; user groups and
+    permissions and the line items with their products are one prefetch
+    each, however many orders the page holds.
+
+    Returns:
+        QuerySet -- orders with select_related() and prefetch_related() applied
+    """
+    return orders.select_related(
+        'customer__user', 'payment_type__customer').prefetch_related(
+            'customer__user__groups', 'customer__user__user_permissions',
+            Prefetch('cart', queryset=ORDER_LINES))
+
+
+class CartProductSerializer(ProductSerializer):
+    """JSON serializer for the products on an order, with the units ordered
+
+    Reads the `quantity_in_cart` and `unit_price` annotations added by
+    cart_products; unit_price is null until the order is checked out.
+    """
+    quantity_in_cart = serializers.IntegerField(read_only=True)
+    unit_price = serializers.FloatField(read_only=True)
+
+    class Meta(ProductSerializer.Meta):
+        fields = ProductSerializer.Meta.fields + ('quantity_in_cart', 'unit_price')
+
+
+def cart_products(order):
+    """Products on an order, one row per line, annotated with the line's units and price"""
+    return Product.objects.filter(cart__order=order).annotate(
+        quantity_in_cart=F('cart__quantity'), unit_price=F('cart__unit_price')).select_related(
+            'customer__user', 'product_type').prefetch_related(
+                'customer__user__groups', 'customer__user__user_permissions')
+
+
+# Most products one bulk cart request may add and remove, keeping every
+# IN list well under SQLite's bound parameter limit
+BULK_CART_MAX = 100
+
+
+def parse_quantity(value, product_id):
+    """Units of a product to add, as sent by the client
+
+    Raises:
+        ValueError -- when the value is not a whole number of at least 1
+    """
+    # int() would turn true into 1 and 2.5 into 2 rather than refuse them
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(f"Quantity for product {product_id} must be a whole number")
+    try:
+        quantity = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Quantity for product {product_id} must be a whole number")
+    if quantity < 1:
+        raise ValueError(f"Quantity for product {product_id} must be at least 1")
+    return quantity
+
+
+def parse_bulk_cart(data):
+    """Validate the body of a bulk cart request
+
+    Arguments:
+        data -- {"add": [{"product_id": 1, "quantity": 2}, ...], "remove": [3, 4]}
+    Returns:
+        tuple -- dict of product id to units to add, and list of product ids to remove
+    Raises:
+        ValueError -- when the body is malformed
+    """
+    if not isinstance(data, dict):
+        raise ValueError("The body must be a JSON object")
+    add = {}
+    for item in data.get("add", []):
+        product_id = int(item["product_id"])
+        quantity = parse_quantity(item.get("quantity", 1), product_id)
+        add[product_id] = add.get(product_id, 0) + quantity
+
+    remove = sorted({int(product_id) for product_id in data.get("remove", [])})
+    if len(add) + len(remove) > BULK_CART_MAX:
+        raise ValueError(f"At most {BULK_CART_MAX} products can change per request")
+    return add, remove
+
+
+# Fields of the flat order representation, read straight from .values()
+FLAT_ORDER_FIELDS = ('id', 'created_at', 'customer_id', 'payment_type_id',
+                     'total', 'item_count')
+
+
 class Orders(ViewSet):
     """Orders for Bangazon Galaydia Empire
     Author: Scott Silver & Matthew Caldwell
@@ -38,10 +168,9 @@ class Orders(ViewSet):
 
     @action(methods=['get'], detail=False)
     def current(self, request):
-        customer = Customer.objects.get(user=request.auth.user)
+        orders = select_for_request(Order.objects.all(), request, OrderSerializer)
         try:
-            my_order = Order.objects.filter(
-                customer=customer, payment_type_id=None).get()
+            my_order = Order.open_cart(request.user.id, queryset=orders)
             serializer = OrderSerializer(
                 my_order, many=False, context={'request': request})
             return Response(serializer.data)
@@ -51,26 +180,27 @@ class Orders(ViewSet):
             return HttpResponseServerError(ex)
 
     def create(self, request):
-        """Handle POST operations
+        """Handle POST operations to add a product to the open order
+
+        Adding a product already in the cart raises its quantity instead
+        of adding another line.
         Returns:
-            Response -- JSON serialized ParkArea instance
+            Response -- Empty body with 204 status code,
+            400 when the quantity is not a whole number of at least 1,
+            409 when the cart was checked out meanwhile
         """
-        order_item = OrderProduct()
-        order_item.product = Product.objects.get(pk=request.data["product_id"])
-
-        current_customer = Customer.objects.get(pk=request.user.id)
-        order = Order.objects.filter(
-            customer=current_customer, payment_type=None)
-
-        if order.exists():
-            order_item.order = order[0]
-        else:
-            new_order = Order()
-            new_order.customer = current_customer
-            new_order.save()
-            order_item.order = new_order
+        product = Product.objects.get(pk=request.data["product_id"])
+        try:
+            quantity = parse_quantity(request.data.get("quantity", 1), product.pk)
+        except ValueError as ex:
+            return Response({'message': ex.args[0]}, status=status.HTTP_400_BAD_REQUEST)
 
-        order_item.save()
+        open_order = Order.open_cart(request.user.id, create=True)
+        try:
+            OrderProduct.add(open_order.pk, product.pk, quantity)
+        except OrderCompleted as ex:
+            # Checked out by another request since open_cart found it
+            return Response({'message': ex.args[0]}, status=status.HTTP_409_CONFLICT)
 
         return Response({}, status=status.HTTP_204_NO_CONTENT)
 
@@ -79,32 +209,33 @@ class Orders(ViewSet):
         Returns:
             Response -- JSON serialized order
         """
-        customer = Customer.objects.get(user=request.auth.user)
-
         try:
-            my_order = Order.objects.filter(
-                customer=customer, payment_type_id=None)
+            my_order = Order.open_cart(request.user.id)
             serializer = OrderSerializer(
                 my_order, context={'request': request})
             return Response(serializer.data)
+        except Order.DoesNotExist as ex:
+            return Response({'message': ex.args[0]}, status=status.HTTP_404_NOT_FOUND)
         except Exception as ex:
             return HttpResponseServerError(ex)
 
     def update(self, request, pk=None):
-        """Handle PUT requests for a park area
+        """Handle PUT requests to check out an order
         Returns:
-            Response -- Empty body with 204 status code
+            Response -- Empty body with 204 status code, 404 for an unknown
+            order, or 409 when it is already paid for or out of stock
         """
 
-        order = Order.objects.get(pk=pk)
-        order.payment_type_id = request.data["payment_type"]
-        products_on_order = Product.objects.filter(cart__order=order)
-        order.save()
-
-        for product in products_on_order:
-            if product.quantity > 0:
-                product.quantity -= 1
-                product.save()
+        try:
+            order = Order.objects.get(pk=pk)
+            order.checkout(request.data["payment_type"])
+        except Order.DoesNotExist as ex:
+            return Response({'message': ex.args[0]}, status=status.HTTP_404_NOT_FOUND)
+        except OrderCompleted as ex:
+            return Response({'message': ex.args[0]}, status=status.HTTP_409_CONFLICT)
+        except OutOfStock as ex:
+            return Response({'message': ex.args[0], 'product_ids': ex.product_ids},
+                            status=status.HTTP_409_CONFLICT)
 
         return Response({}, status=status.HTTP_204_NO_CONTENT)
 
@@ -128,81 +259,114 @@ class Orders(ViewSet):
     def list(self, request):
         """Handle GET requests to orders resource
 
+        Query params:
+            cart -- return only the open order
+            limit, offset -- offset pagination
+            cursor -- keyset pagination, newest order first
+            flat -- true for rows of ids and scalar fields instead of nested objects
         Returns:
-            Response -- JSON serialized list of orders with customer
+            Response -- JSON serialized list of orders with customer and line items
         """
 
         orders = Order.objects.all()
-        customer = Customer.objects.get(pk=request.user.id)
 
         # Sends back all closed orders for the order history view, or the single open order to display in cart view
         cart = self.request.query_params.get('cart', None)
-        orders = orders.filter(customer=customer)
-        print("orders", orders)
+        # The default ordering is customer_id, a constant within one
+        # customer's history, so pages need id to be stable
+        orders = orders.filter(customer__user_id=request.user.id).order_by('-id')
         if cart is not None:
-            orders = orders.filter(payment=None).get()
-            print("orders filtered", orders)
+            try:
+                orders = Order.open_cart(request.user.id)
+            except Order.DoesNotExist as ex:
+                return Response({'message': ex.args[0]}, status=status.HTTP_404_NOT_FOUND)
             serializer = OrderSerializer(
                 orders, many=False, context={'request': request}
             )
+        elif wants_flat(request):
+            return list_response(self, request, orders.values(*FLAT_ORDER_FIELDS), None)
         else:
-            serializer = OrderSerializer(
-                orders, many=True, context={'request': request}
-            )
+            return list_response(self, request, order_history(orders), OrderHistorySerializer)
         return Response(serializer.data)
 
     # Example request:
     #   http://localhost:8000/orders/cart
     @action(methods=['get', 'put'], detail=False)
     def cart(self, request):
-        if request.method == "GET":
-            current_user = Customer.objects.get(user=request.auth.user)
+        """Handle GET requests for the open order's products, and PUT
+        requests taking one unit of `product_id` off it
 
+        Returns:
+            Response -- JSON serialized products with quantity_in_cart
+        """
         try:
-            open_order = Order.objects.get(
-                customer=current_user, payment_type=None)
-            products_on_order = Product.objects.filter(cart__order=open_order)
+            open_order = Order.open_cart(request.user.id)
         except Order.DoesNotExist as ex:
             return Response({'message': ex.args[0]}, status=status.HTTP_404_NOT_FOUND)
 
-        serializer = ProductSerializer(
-            products_on_order, many=True, context={'request': request})
+        if request.method == "PUT":
+            removed = OrderProduct.remove(open_order.pk, request.data["product_id"])
+            if not removed:
+                return Response({'message': 'Product is not in the cart'},
+                                status=status.HTTP_404_NOT_FOUND)
+
+        serializer = CartProductSerializer(
+            cart_products(open_order), many=True, context={'request': request})
         return Response(serializer.data)
 
-        if request.method == "PUT":
-            # request.data["product_id"]
-            current_user = Customer.objects.get(user=request.auth.user)
-            product = Product.objects.get(pk=request.data["product_id"])
-            try:
-                open_order = Order.objects.get(
-                    customer=current_user, payment_type=None)
-                open_order.product = product
+    # Example request:
+    #   POST http://localhost:8000/orders/bulk
+    #   {"add": [{"product_id": 1, "quantity": 2}, {"product_id": 7}], "remove": [3]}
+    @action(methods=['post'], detail=False)
+    def bulk(self, request):
+        """Handle POST requests adding and removing many products on the open order
 
-                products_on_order = OrderProduct.objects.filter(
-                    order=open_order, product=open_order.product)[0]
+        Every product is checked with one IN query and the cart changes
+        in one transaction, so a bundle costs a fixed number of queries
+        however many products it holds.
 
-            except Product.DoesNotExist as ex:
-                return Response({'message': ex.args[0]}, status=status.HTTP_404_NOT_FOUND)
+        Returns:
+            Response -- JSON serialized products with quantity_in_cart,
+            400 for a malformed body or unknown products
+        """
+        try:
+            add, remove = parse_bulk_cart(request.data)
+        except (KeyError, TypeError, ValueError) as ex:
+            return Response({'message': f"Invalid bulk cart request: {ex}"},
+                            status=status.HTTP_400_BAD_REQUEST)
 
-            # find order for customer
-            # thing_to_delete = OrderProduct.objects.filter(order=open_order, product=product)[0]
-            # things_to_delete.delete()
-            products_on_order.delete()
+        known = set(Product.objects.filter(pk__in=list(add)).order_by().values_list('id', flat=True))
+        unknown = sorted(set(add) - known)
+        if unknown:
+            return Response({'message': 'Unknown products', 'product_ids': unknown},
+                            status=status.HTTP_400_BAD_REQUEST)
 
-            serializer = ProductSerializer(
-                products_on_order, many=True, context={'request': request})
-            return Response(serializer.data)
+        try:
+            with transaction.atomic():
+                open_order = Order.open_cart(request.user.id, create=True)
+                OrderProduct.change_many(open_order.pk, add, remove)
+        except (IntegrityError, OrderCompleted):
+            return Response({'message': 'The cart changed during the request, try again'},
+                            status=status.HTTP_409_CONFLICT)
+
+        serializer = CartProductSerializer(
+            cart_products(open_order), many=True, context={'request': request})
+        return Response(serializer.data)
 
     # Created by Joy
     # To filter completed orders (orders with an existing payment type)
     # Example request:  http://localhost:8000/orders/completed
     @action(methods=['get'], detail=False)
+    # The history embeds each line's product and the customer with its user
+    @conditional_get('order', 'paymenttype', 'product', 'customer', per_user=True)
     def completed(self, request):
-        customer = Customer.objects.get(user=request.auth.user)
+        my_order = Order.objects.filter(
+            customer__user_id=request.user.id, payment_type__isnull=False)
+        if wants_flat(request):
+            return Response(list(my_order.values(*FLAT_ORDER_FIELDS)))
+        my_order = select_for_request(order_history(my_order), request, OrderHistorySerializer)
         try:
-            my_order = Order.objects.filter(
-                customer=customer, payment_type__isnull=False)
-            serializer = OrderSerializer(
+            serializer = OrderHistorySerializer(
                 my_order, many=True, context={'request': request})
             return Response(serializer.data)
         except Order.DoesNotExist as ex:
@@ -218,11 +382,11 @@ class Orders(ViewSet):
 
         try:
             old_order = Order.objects.get(pk=order_id)
-            products_on_order = Product.objects.filter(cart__order=old_order)
+            products_on_order = cart_products(old_order)
         except Order.DoesNotExist as ex:
             return Response({'message': ex.args[0]}, status=status.HTTP_404_NOT_FOUND)
 
-        serializer = ProductSerializer(
+        serializer = CartProductSerializer(
             products_on_order, many=True, context={'request': request})
 
         # Create a dictionary that will hold the values to be sent back to the client side
@@ -231,28 +395,46 @@ class Orders(ViewSet):
         # Create a products key within the dictionary containing the data from the Serializer
         response["products"] = serializer.data
 
-        # Initialize the total price variable to zero
-        total = 0
-
-        # Loop through the products, add the price of each item to the total variable that was initialized
-        for product in products_on_order:
-            total += product.price
-
-        # Create a total key within the dictionary containing the result of the loop above.
-        response["total"] = total
+        # Completed orders carry the total frozen at checkout; an open
+        # cart is summed by the database at its current prices
+        if old_order.total is not None:
+            response["total"] = old_order.total
+            response["item_count"] = old_order.item_count
+        else:
+            response.update(old_order.compute_totals())
 
         # Example format of data being sent back to the client side--
-        # response = {products: [{}.{}.{}], total: 35.00}
+        # response = {products: [{}.{}.{}], total: 35.00, item_count: 3}
 
         return Response(response)
 
+    # Example request:
+    #   http://localhost:8000/orders/export?output=csv&open=true
+    @action(methods=['get'], detail=False, permission_classes=[IsAdminUser])
+    def export(self, request):
+        """Handle GET requests streaming every order
+
+        Query params:
+            open -- true for open orders only, false for completed orders only
+            output -- ndjson (default) or csv
+        Returns:
+            StreamingHttpResponse -- NDJSON or CSV rows, one per order
+        """
+        orders = Order.objects.order_by('id')
+        if 'open' in request.query_params:
+            orders = orders.filter(payment_type__isnull=query_flag(request, 'open'))
+        fields = {name: name for name in FLAT_ORDER_FIELDS}
+        return export_response(request, orders, fields, 'orders')
+
     @action(methods=['get'], detail=False)
     def multipleorders(self, request):
+        my_order = Order.objects.filter(
+            payment_type__isnull=True)
+        if wants_flat(request):
+            return Response(list(my_order.values(*FLAT_ORDER_FIELDS)))
+        my_order = select_for_request(order_history(my_order), request, OrderHistorySerializer)
         try:
-            my_order = Order.objects.filter(
-                payment_type__isnull=True)
-
-            serializer = OrderSerializer(
+            serializer = OrderHistorySerializer(
                 my_order, many=True, context={'request': request})
             return Response(serializer.data)
         except Order.DoesNotExist as ex:
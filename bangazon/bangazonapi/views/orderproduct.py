@@ -1,14 +1,21 @@
 """View module for handling requests about orderproducts"""
 from django.http import HttpResponseServerError
+from rest_framework.decorators import action
+from rest_framework.permissions import IsAdminUser
 from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
 from rest_framework import serializers
 from rest_framework import status
 from bangazonapi.models import OrderProduct, Product, Order
+from bangazonapi.models.order import OrderCompleted
 from .product import ProductSerializer
-from .order import OrderSerializer
+from .order import OrderSerializer, parse_quantity
+from .export import export_response
+from .fields import DynamicFieldsMixin, expandable, select_for_request
+from .pagination import list_response
 
-class OrderProductSerializer(serializers.HyperlinkedModelSerializer):
+@expandable
+class OrderProductSerializer(DynamicFieldsMixin, serializers.HyperlinkedModelSerializer):
 
     # Author: Sam Birky
     # Purpose: Allow a user to communicate with the Bangazon database to GET POST and DELETE entries.
@@ -25,7 +32,7 @@ class OrderProductSerializer(serializers.HyperlinkedModelSerializer):
             view_name='orderProduct',
             lookup_field='id'
         )
-        fields = ('id', 'url', 'order', 'product')
+        fields = ('id', 'url', 'order', 'product', 'quantity')
         depth = 1
 
 
@@ -35,27 +42,50 @@ class OrderProducts(ViewSet):
     def list(self, request):
         """Handle GET requests to orderProducts resource
 
+        Query params:
+            limit, offset -- offset pagination
+            cursor -- keyset pagination, newest row first
         Returns:
             Response -- JSON serialized list of orderProducts
         """
-        order_products = OrderProduct.objects.all()
-        serializer = OrderProductSerializer(
-            order_products,
-            many=True,
-            context={'request': request}
-        )
-        return Response(serializer.data)
+        # Newest first like the cursor; the default order__customer_id
+        # ordering is not unique, so offset pages could skip or repeat rows
+        order_products = OrderProduct.objects.select_related('order', 'product').order_by('-id')
+        return list_response(self, request, order_products, OrderProductSerializer)
+
+    # Example request:
+    #   http://localhost:8000/orderproducts/export?output=csv
+    @action(methods=['get'], detail=False, permission_classes=[IsAdminUser])
+    def export(self, request):
+        """Handle GET requests streaming every order line
+
+        Returns:
+            StreamingHttpResponse -- NDJSON or CSV rows, one per order line
+        """
+        fields = {name: name for name in
+                  ('id', 'order_id', 'product_id', 'quantity', 'unit_price')}
+        return export_response(request, OrderProduct.objects.order_by('id'), fields, 'orderproducts')
 
     def create(self, request):
         """Handle POST operations
 
+        Posting a product the order already holds raises that line's quantity.
         Returns:
-            Response -- JSON serialized order products instance
+            Response -- JSON serialized order products instance,
+            400 when the quantity is not a whole number of at least 1,
+            409 when the order has been paid for
         """
-        order_product = OrderProduct()
-        order_product.order = Order.objects.get(pk=request.data["order"])
-        order_product.product = Product.objects.get(pk=request.data["product"])
-        order_product.save()
+        order = Order.objects.get(pk=request.data["order"])
+        product = Product.objects.get(pk=request.data["product"])
+        try:
+            quantity = parse_quantity(request.data.get("quantity", 1), product.pk)
+        except ValueError as ex:
+            return Response({'message': ex.args[0]}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            OrderProduct.add(order.pk, product.pk, quantity)
+        except OrderCompleted as ex:
+            return Response({'message': ex.args[0]}, status=status.HTTP_409_CONFLICT)
+        order_product = OrderProduct.objects.get(order=order, product=product)
 
         serializer = OrderProductSerializer(
             order_product, context={'request': request})
@@ -68,8 +98,11 @@ class OrderProducts(ViewSet):
         Returns:
             Response -- JSON serialized payment type instance
         """
+        order_products = select_for_request(
+            OrderProduct.objects.select_related('order', 'product'),
+            request, OrderProductSerializer)
         try:
-            single_order_product = OrderProduct.objects.get(pk=pk)
+            single_order_product = order_products.get(pk=pk)
             serializer = OrderProductSerializer(
                 single_order_product, context={'request': request})
             return Response(serializer.data)
@@ -0,0 +1,84 @@
+"""Pagination helpers shared by the Bangazon ViewSets"""
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+from rest_framework.response import Response
+from .fields import select_for_request
+
+
+class KeysetPagination(CursorPagination):
+    """Opaque cursor pagination keyed on a unique, indexed ordering
+
+    Each page is a range query that starts at the last key of the previous
+    page, so deep pages cost the same as the first one. Send an empty
+    `cursor` param to get the first page, then follow the next/previous
+    links. `limit` sets the page size.
+    """
+
+    ordering = '-id'
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+    def __init__(self, ordering=None):
+        if ordering is not None:
+            self.ordering = ordering
+
+
+def get_paginator(request, cursor_ordering='-id', paginate_by_default=False):
+    """Pick the paginator the client asked for
+
+    List endpoints stay unpaginated unless the request carries paging
+    params, so existing clients keep receiving a plain JSON array.
+    A `cursor` param selects keyset pagination; `limit`/`offset`
+    select the offset pagination set in REST_FRAMEWORK, which is also
+    used without params when paginate_by_default is set.
+
+    Returns:
+        BasePagination -- paginator instance, or None for an unpaginated list
+    """
+    params = request.query_params
+    keyset = KeysetPagination(cursor_ordering)
+    if keyset.cursor_query_param in params:
+        return keyset
+
+    paginator = LimitOffsetPagination()
+    if paginate_by_default:
+        return paginator
+    if paginator.limit_query_param in params or paginator.offset_query_param in params:
+        return paginator
+    return None
+
+
+def list_response(view, request, queryset, serializer_class, cursor_ordering='-id',
+                  paginate_by_default=False):
+    """Serialize a list of objects, paginated when the client asked for a page
+
+    The queryset is narrowed to the requested ?fields= and ?expand= and
+    sliced in SQL by the paginator, so only the columns and rows on the
+    requested page are loaded.
+
+    Arguments:
+        serializer_class -- serializer for the objects, or None when the
+            queryset already yields plain rows, such as a .values() queryset
+        cursor_ordering -- unique field (or fields) the keyset cursor pages along
+        paginate_by_default -- page with limit/offset even when no paging params are sent
+    Returns:
+        Response -- JSON serialized list, or a paginated envelope
+    """
+    paginator = get_paginator(request, cursor_ordering, paginate_by_default)
+    if isinstance(paginator, KeysetPagination) and not queryset.query.can_filter():
+        raise ParseError("This listing cannot be paged with a cursor")
+
+    if serializer_class is not None:
+        queryset = select_for_request(queryset, request, serializer_class)
+
+    if paginator is not None:
+        queryset = paginator.paginate_queryset(queryset, request, view=view)
+
+    if serializer_class is None:
+        data = list(queryset)
+    else:
+        data = serializer_class(queryset, many=True, context={'request': request}).data
+
+    if paginator is not None:
+        return paginator.get_paginated_response(data)
+    return Response(data)
@@ -0,0 +1,42 @@
+"""Query param helpers shared by the Bangazon ViewSets"""
+
+
+def query_flag(request, name, default=False):
+    """Read a boolean query param such as ?in_stock=true
+
+    Returns:
+        bool -- True for 1/true/yes, False for any other value, default when absent
+    """
+    value = request.query_params.get(name, None)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes')
+
+
+def query_int(request, name, minimum=0):
+    """Read a whole number query param such as ?quantity=10
+
+    Returns:
+        int -- the value, or None when absent
+    Raises:
+        ValueError -- when the value is not a whole number of at least minimum
+    """
+    value = request.query_params.get(name, None)
+    if value is None:
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        number = None
+    if number is None or number < minimum:
+        raise ValueError(f"{name} must be a whole number of at least {minimum}")
+    return number
+
+
+def wants_flat(request):
+    """Whether the client asked for the flat representation with ?flat=true
+
+    Flat rows carry related objects as ids and are read with .values(),
+    so no model instances or nested serializers are built.
+    """
+    return query_flag(request, 'flat')
@@ -6,9 +6,12 @@ from rest_framework.response import Response
 from rest_framework import serializers
 from rest_framework import status
 from bangazonapi.models import PaymentType, Customer
+from .fields import DynamicFieldsMixin, expandable, select_for_request
+from .pagination import list_response
 
 
-class PaymentTypeSerializer(serializers.HyperlinkedModelSerializer):
+@expandable
+class PaymentTypeSerializer(DynamicFieldsMixin, serializers.HyperlinkedModelSerializer):
     """JSON serializer for payment types
 
     Arguments:
@@ -38,7 +41,7 @@ class PaymentTypes(ViewSet):
         payment_type.merchant_name = request.data["merchant_name"]
         payment_type.account_number = request.data["account_number"]
         payment_type.expiration_date = request.data["expiration_date"]
-        payment_type.customer = Customer.objects.get(user=request.auth.user)
+        payment_type.customer = request.user.customer
         payment_type.save()
 
         serializer = PaymentTypeSerializer(payment_type, context={'request': request})
@@ -51,8 +54,10 @@ class PaymentTypes(ViewSet):
         Returns:
             Response -- JSON serialized payment type instance
         """
+        payment_types = select_for_request(
+            PaymentType.objects.all(), request, PaymentTypeSerializer)
         try:
-            payment_type = PaymentType.objects.get(pk=pk)
+            payment_type = payment_types.get(pk=pk)
             serializer = PaymentTypeSerializer(payment_type, context={'request': request})
             return Response(serializer.data)
         except Exception as ex:
@@ -99,11 +104,6 @@ class PaymentTypes(ViewSet):
         Returns:
             Response -- JSON serialized list of payment_type
         """
-        customer = Customer.objects.get(user=request.auth.user)
-        payment_types = PaymentType.objects.filter(customer=customer)
-        serializer = PaymentTypeSerializer(
-            payment_types,
-            many=True,
-            context={'request': request}
-        )
-        return Response(serializer.data)
\ No newline at end of file
+        customer = request.user.customer
+        payment_types = PaymentType.objects.filter(customer=customer).select_related('customer')
+        return list_response(self, request, payment_types, PaymentTypeSerializer)
\ No newline at end of file
@@ -6,7 +6,14 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework import serializers
 from rest_framework import status
-from bangazonapi.models import Product, Customer, ProductType
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from bangazonapi.models import Product, Customer, ProductType, search_products
+from bangazonapi.cache import cached_response
+from bangazonapi.models.product import NEWEST_MAX
+from .conditional import conditional_get
+from .fields import DynamicFieldsMixin, expandable, select_for_request
+from .pagination import list_response
+from .params import query_flag, query_int, wants_flat
 
 """HyperlinkedModelSerializer class
 Author: Matthew Caldwell
@@ -18,7 +25,8 @@ Methods: GET, PUT, POST, DELETE, listTwenty(made by Sam)
 """
 
 
-class ProductSerializer(serializers.HyperlinkedModelSerializer):
+@expandable
+class ProductSerializer(DynamicFieldsMixin, serializers.HyperlinkedModelSerializer):
     """JSON serializer for products
     Arguments:
         serializers.HyperlinkedModelSerializer
@@ -32,9 +40,14 @@ class ProductSerializer(serializers.HyperlinkedModelSerializer):
         )
         fields = ('id', 'url', 'name', 'price', 'description', 'quantity',
                   'location', 'created_at', 'customer', 'product_type', 'total_sold')
+        read_only_fields = ('total_sold',)
         depth = 2
 
 
+# Fields of the flat product representation, read straight from .values()
+FLAT_PRODUCT_FIELDS = ('id', 'name', 'price', 'quantity', 'location', 'created_at',
+                       'customer_id', 'product_type_id', 'total_sold')
+
 
 class Products(ViewSet):
     """Products for Bangazon Galaydia Empire"""
@@ -46,7 +59,7 @@ class Products(ViewSet):
         """
         new_product = Product()
         new_product.name = request.data["name"]
-        new_product.customer = Customer.objects.get(user=request.auth.user)
+        new_product.customer = request.user.customer
         new_product.price = request.data["price"]
         new_product.description = request.data["description"]
         new_product.quantity = request.data["quantity"]
@@ -61,13 +74,18 @@ class Products(ViewSet):
 
         return Response(serializer.data)
 
+    @conditional_get('product', 'producttype', 'customer')
+    @cached_response('product:{pk}', 'types', 'customers')
     def retrieve(self, request, pk=None):
         """Handle GET requests for single product
         Returns:
             Response -- JSON serialized park area instance
         """
+        products = select_for_request(
+            Product.objects.select_related('customer__user', 'product_type'),
+            request, ProductSerializer)
         try:
-            single_product = Product.objects.get(pk=pk)
+            single_product = products.get(pk=pk)
             serializer = ProductSerializer(
                 single_product, context={'request': request})
             return Response(serializer.data)
@@ -102,62 +120,147 @@ class Products(ViewSet):
         except Exception as ex:
             return Response({'message': ex.args[0]}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @conditional_get('product', 'producttype', 'customer')
+    @cached_response('products', 'types', 'customers')
     def list(self, request):
         """Handle GET requests to products resource
+
+        Query params:
+            category -- only products of this product type
+            location -- only products at this location
+            in_stock -- true/false; category and location imply true unless false is given
+            quantity -- only the N newest products of the listing, at most NEWEST_MAX
+            limit, offset -- offset pagination
+            cursor -- keyset pagination, newest product first
+            flat -- true for rows of ids and scalar fields instead of nested objects
         Returns:
-            Response -- JSON serialized list of products
+            Response -- JSON serialized list of products,
+            400 when quantity or category is not a whole number
         """
-        products = Product.objects.all()
-        product_list = list()
+        try:
+            quantity = query_int(request, 'quantity')
+            category = query_int(request, 'category', minimum=1)
+        except ValueError as ex:
+            return Response({'message': ex.args[0]}, status=status.HTTP_400_BAD_REQUEST)
+        if quantity is not None:
+            quantity = min(quantity, NEWEST_MAX)
 
-        # support filtering by category
-        category = self.request.query_params.get('category', None)
+        if wants_flat(request):
+            products = Product.objects.values(*FLAT_PRODUCT_FIELDS)
+            serializer_class = None
+        else:
+            products = Product.objects.select_related(
+                'customer__user', 'product_type').prefetch_related(
+                    'customer__user__groups', 'customer__user__user_permissions')
+            serializer_class = ProductSerializer
+
+        # All filters build up a single query, served by the
+        # (product_type, quantity) and (location, quantity) indexes
         if category is not None:
             products = products.filter(product_type_id=category)
-            for product in products:
-                if product.quantity > 0:
-                    product_list.append(product)
-            products = product_list
-
-        # support filtering by quantity
-        quantity = self.request.query_params.get('quantity', None)
-        if quantity is not None:
-            quantity = int(quantity)
-            length = len(products)
-            new_products = list()
-            count = 0
-            for product in products:
-                count += 1
-                if count - 1 + quantity >= length:
-                    new_products.append(product)
-                    if count == length:
-                        products = new_products
-                        break
 
         location = self.request.query_params.get('location', None)
         if location is not None:
             products = products.filter(location=location)
-            for product in products:
-                if product.quantity > 0:
-                    product_list.append(product)
-            products = product_list
 
-        aproduct = list(products)[0]
+        in_stock = query_flag(
+            request, 'in_stock', default=category is not None or location is not None)
+        if in_stock:
+            products = products.filter(quantity__gt=0)
 
-        serializer = ProductSerializer(
-            products, many=True, context={'request': request})
+        # support limiting to the N newest products of the listing
+        if quantity is not None:
+            products = products.order_by('-created_at', '-id')[:quantity]
+        else:
+            products = products.order_by('product_type', 'id')
 
+        return list_response(self, request, products, serializer_class)
+
+    # Example request:
+    #   http://localhost:8000/products/newest?limit=20&category=1
+    @action(methods=['get'], detail=False)
+    @cached_response('products', 'types', 'customers')
+    def newest(self, request):
+        """Handle GET requests for the newest products, served from cache
+
+        Query params:
+            limit -- number of products, default 20
+            category -- optional product type id
+        Returns:
+            Response -- JSON serialized list of products, newest first
+        """
+        limit = self.request.query_params.get('limit', 20)
+        category = self.request.query_params.get('category', None)
+        try:
+            products = Product.newest(limit, category)
+        except ValueError as ex:
+            return Response({'message': ex.args[0]}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = ProductSerializer(products, many=True, context={'request': request})
         return Response(serializer.data)
 
+    # Example request:
+    #   http://localhost:8000/products/search?q=fluffy%20dog&limit=10&offset=0
+    @action(methods=['get'], detail=False)
+    def search(self, request):
+        """Handle GET requests for a full-text product search
+
+        Query params:
+            q -- words to look for in product names and descriptions
+            limit -- results per page, default 20, at most 100
+            offset -- number of ranked results to skip; only the newest
+                SEARCH_CANDIDATES matches are ranked, so pages end there
+        Returns:
+            Response -- ranked page of JSON serialized products with next/previous links
+        """
+        text = self.request.query_params.get('q', '')
+        try:
+            limit = min(int(self.request.query_params.get('limit', 20)), 100)
+            offset = int(self.request.query_params.get('offset', 0))
+        except ValueError as ex:
+            return Response({'message': ex.args[0]}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1 or offset < 0:
+            return Response({'message': 'limit and offset must be positive'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # Ask for one extra row to learn whether a next page exists without a COUNT
+        products = search_products(text, limit + 1, offset)
+        has_next = len(products) > limit
+        products = products[:limit]
+
+        url = request.build_absolute_uri()
+        url = replace_query_param(url, 'limit', limit)
+        next_url = replace_query_param(url, 'offset', offset + limit) if has_next else None
+        previous_url = None
+        if offset > 0:
+            previous_url = remove_query_param(url, 'offset')
+            if offset - limit > 0:
+                previous_url = replace_query_param(url, 'offset', offset - limit)
+
+        serializer = ProductSerializer(products, many=True, context={'request': request})
+        return Response({
+            'next': next_url,
+            'previous': previous_url,
+            'results': serializer.data
+        })
+
     # Custom Action that supports filtering products by customer by creating a new route
     @action(methods=['get'], detail=False)
     def myproduct(self, request):
 
         try:
-            customer = Customer.objects.get(user=request.auth.user)
+            customer = request.user.customer
             products_of_customer = Product.objects.filter(customer=customer)
-        except Product.DoesNotExist as ex:
+        except Customer.DoesNotExist as ex:
             return Response({'message': ex.args[0]}, status=status.HTTP_404_NOT_FOUND)
 
+        if wants_flat(request):
+            return Response(list(products_of_customer.values(*FLAT_PRODUCT_FIELDS)))
+
+        products_of_customer = select_for_request(
+            products_of_customer.select_related(
+                'customer__user', 'product_type').prefetch_related(
+                    'customer__user__groups', 'customer__user__user_permissions'),
+            request, ProductSerializer)
         serializer = ProductSerializer(products_of_customer, many=True, context={'request': request})
         return Response(serializer.data)
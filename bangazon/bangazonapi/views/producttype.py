@@ -1,13 +1,21 @@
 """View module for handling requests about product types"""
 from django.http import HttpResponseServerError
+from django.db.models import Count, OuterRef, Prefetch, Q, Subquery
+from rest_framework.decorators import action
 from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
 from rest_framework import serializers
 from rest_framework import status
-from bangazonapi.models import ProductType
+from bangazonapi.models import Product, ProductType
+from bangazonapi.cache import cached_response
+from .conditional import conditional_get
+from .fields import DynamicFieldsMixin, expandable, select_for_request
+from .pagination import list_response
+from .product import ProductSerializer
 
 
-class ProductTypeSerializer(serializers.HyperlinkedModelSerializer):
+@expandable
+class ProductTypeSerializer(DynamicFieldsMixin, serializers.HyperlinkedModelSerializer):
 
     # Author: Sam Birky
     # Purpose: Allow a user to communicate with the Bangazon database to GET PUT POST and DELETE entries.
@@ -27,22 +35,100 @@ class ProductTypeSerializer(serializers.HyperlinkedModelSerializer):
         fields = ('id', 'url', 'name', 'product_set')
         depth = 2
 
+
+# Number of newest product ids listed with each product type
+NEWEST_PER_TYPE = 3
+
+
+class GroupedSubquery(Subquery):
+    """Scalar subquery correlated only on columns the query groups by
+
+    Django would otherwise repeat it in GROUP BY and run it once per
+    joined row instead of once per group.
+    """
+
+    def get_group_by_cols(self, *args):
+        return []
+
+
+class ProductTypeSummarySerializer(DynamicFieldsMixin, serializers.HyperlinkedModelSerializer):
+    """JSON serializer for product types with per-type product aggregates
+
+    Reads the annotations added by ProductTypes.summaries instead of
+    embedding the products; they are paged through the `products` link.
+
+    Arguments:
+        serializers.HyperlinkedModelSerializer
+    """
+    product_count = serializers.IntegerField(read_only=True)
+    in_stock_count = serializers.IntegerField(read_only=True)
+    newest_products = serializers.SerializerMethodField()
+    products = serializers.HyperlinkedIdentityField(view_name='producttype-products')
+
+    class Meta:
+        model = ProductType
+        fields = ('id', 'url', 'name', 'product_count', 'in_stock_count',
+                  'newest_products', 'products')
+
+    def get_newest_products(self, product_type):
+        newest = [getattr(product_type, f"newest_{position}")
+                  for position in range(NEWEST_PER_TYPE)]
+        return [product_id for product_id in newest if product_id is not None]
+
+
 class ProductTypes(ViewSet):
     """Product types for Bangazon Galaydia Empire"""
 
+    @conditional_get('product', 'producttype')
+    @cached_response('products', 'types')
     def list(self, request):
         """Handle GET requests to product types resource
 
         Returns:
-            Response -- JSON serialized list of product types
+            Response -- JSON serialized list of product types with product counts
         """
-        product_types = ProductType.objects.all()
-        serializer = ProductTypeSerializer(
-            product_types,
-            many=True,
-            context={'request': request}
-        )
-        return Response(serializer.data)
+        return list_response(self, request, self.summaries(), ProductTypeSummarySerializer)
+
+    @staticmethod
+    def summaries():
+        """Product types annotated with their product aggregates
+
+        The counts come from one GROUP BY over the (product_type, quantity)
+        index, and each newest id is a correlated LIMIT 1 subquery on the
+        (product_type, created_at) index, so the whole listing is one query.
+
+        Returns:
+            QuerySet -- product types with product_count, in_stock_count
+                and newest_0 .. newest_N annotations
+        """
+        newest = Product.objects.filter(
+            product_type=OuterRef('pk')).order_by('-created_at', '-id').values('id')
+        positions = {
+            f"newest_{position}": GroupedSubquery(newest[position:position + 1])
+            for position in range(NEWEST_PER_TYPE)
+        }
+        return ProductType.objects.annotate(
+            product_count=Count('product'),
+            in_stock_count=Count('product', filter=Q(product__quantity__gt=0)),
+            **positions)
+
+    # Example request:
+    #   http://localhost:8000/producttypes/1/products?limit=20&offset=40
+    @action(methods=['get'], detail=True)
+    def products(self, request, pk=None):
+        """Handle GET requests for the products of one product type
+
+        Query params:
+            limit, offset -- offset pagination, 10 per page by default
+            cursor -- keyset pagination, newest product first
+        Returns:
+            Response -- paginated JSON serialized products
+        """
+        products = Product.objects.filter(product_type_id=pk).select_related(
+            'customer__user', 'product_type').prefetch_related(
+                'customer__user__groups', 'customer__user__user_permissions').order_by('id')
+        return list_response(self, request, products, ProductSerializer,
+                             paginate_by_default=True)
 
     def create(self, request):
         """Handle POST operations
@@ -58,14 +144,21 @@ class ProductTypes(ViewSet):
 
         return Response(serializer.data)
 
+    @conditional_get('product', 'producttype', 'customer')
+    @cached_response('producttype:{pk}', 'products', 'customers')
     def retrieve(self, request, pk=None):
         """Handle GET requests for single product type
 
         Returns:
             Response -- JSON serialized product type instance
         """
+        # The nested products embed their customer, so join it in once
+        products = Product.objects.select_related('customer')
+        product_types = select_for_request(
+            ProductType.objects.prefetch_related(Prefetch('product_set', queryset=products)),
+            request, ProductTypeSerializer)
         try:
-            product_type = ProductType.objects.get(pk=pk)
+            product_type = product_types.get(pk=pk)
             serializer = ProductTypeSerializer(product_type, context={'request': request})
             return Response(serializer.data)
         except Exception as ex:
@@ -1,12 +1,51 @@
 import json
 from django.http import HttpResponse
-from django.contrib.auth import login, authenticate
+from django.contrib.auth.hashers import check_password, make_password
 from django.contrib.auth.models import User
 from rest_framework.authtoken.models import Token
 from django.views.decorators.csrf import csrf_exempt
+from bangazonapi import hashing
 from bangazonapi.models import Customer
 
 
+def busy_response(ex):
+    '''503 telling the client to retry once a hashing slot is free'''
+    response = HttpResponse(json.dumps({"message": ex.args[0]}),
+                            content_type='application/json', status=503)
+    response['Retry-After'] = '1'
+    return response
+
+
+def authenticate(username, password):
+    '''Check a username and password with the hash admitted by bangazonapi.hashing
+
+    Mirrors ModelBackend.authenticate: unknown usernames still pay for a
+    hash so they cannot be told apart by timing, inactive users are
+    refused, and hashes from an outdated hasher are upgraded when a
+    hashing slot is free.
+    Raises:
+      HashingBusy -- when no hashing slot is free to check the password
+    '''
+    try:
+        user = User._default_manager.get_by_natural_key(username)
+    except User.DoesNotExist:
+        hashing.run('login', make_password, password)
+        return None
+
+    outdated = []
+    if not hashing.run('login', check_password, password, user.password, outdated.append):
+        return None
+    if outdated:
+        try:
+            user.password = hashing.run('login', make_password, password)
+        except hashing.HashingBusy:
+            # The password is already verified; upgrade on a quieter login
+            pass
+        else:
+            user.save(update_fields=['password'])
+    return user if user.is_active else None
+
+
 @csrf_exempt
 def login_user(request):
 
@@ -21,10 +60,13 @@ def login_user(request):
     # If the request is a HTTP POST, try to pull out the relevant information.
     if request.method == 'POST':
 
-        # Use the built-in authenticate method to verify
+        # Verify the password within the hashing limit
         username = req_body['username']
         password = req_body['password']
-        authenticated_user = authenticate(username=username, password=password)
+        try:
+            authenticated_user = authenticate(username, password)
+        except hashing.HashingBusy as ex:
+            return busy_response(ex)
 
         # If authentication was successful, respond with their token
         if authenticated_user is not None:
@@ -49,15 +91,21 @@ def register_user(request):
     # Load the JSON string of the request body into a dict
     req_body = json.loads(request.body.decode())
 
-    # Create a new user by invoking the `create_user` helper method
-    # on Django's built-in User model
-    new_user = User.objects.create_user(
-        username=req_body['username'],
-        email=req_body['email'],
-        password=req_body['password'],
+    # Hash the password within the hashing limit, then create the user the way
+    # the `create_user` helper on Django's built-in User model does
+    try:
+        password = hashing.run('register', make_password, req_body['password'])
+    except hashing.HashingBusy as ex:
+        return busy_response(ex)
+
+    new_user = User(
+        username=User.normalize_username(req_body['username']),
+        email=User.objects.normalize_email(req_body['email']),
+        password=password,
         first_name=req_body['first_name'],
         last_name=req_body['last_name']
     )
+    new_user.save()
 
     customer = Customer.objects.create(
         phone_number=req_body['phone_number'],
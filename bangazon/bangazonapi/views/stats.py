@@ -0,0 +1,43 @@
+"""View module for operational statistics of the Bangazon API"""
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from bangazonapi import cache, hashing, middleware
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def cache_stats(request):
+    """Handle GET requests for catalog cache statistics
+
+    Returns:
+        Response -- JSON hit, miss, hit rate, invalidation and eviction counts
+    """
+    return Response(cache.stats())
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def auth_stats(request):
+    """Handle GET requests for password hashing statistics
+
+    Returns:
+        Response -- JSON completed, rejected and in-flight counts and hash
+        timings for login and register
+    """
+    return Response(hashing.stats())
+
+
+@api_view(['GET', 'DELETE'])
+@permission_classes([IsAdminUser])
+def query_stats(request):
+    """Handle GET requests for per-endpoint query and latency statistics,
+    and DELETE requests to start counting afresh
+
+    Returns:
+        Response -- JSON query counts, timings, response sizes and N+1
+        findings per endpoint
+    """
+    if request.method == 'DELETE':
+        middleware.reset()
+    return Response(middleware.stats())